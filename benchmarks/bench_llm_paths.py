@@ -0,0 +1,128 @@
+# benchmarks/bench_llm_paths.py
+"""
+Load test for the LLM-bound engine paths against an OpenAI-compatible server,
+normally the offline stand-in:
+
+    python mock_openai_server.py --port 8001 --latency lognormal:0.0,0.4 &
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=offline \
+        python benchmarks/bench_llm_paths.py --requests 200 --concurrency 50
+
+The LLM response cache is disabled unless --cache is given, and concurrent
+identical prompts are not coalesced unless --coalesce is given, so every call
+reaches the server. run_all_analyses gets different inputs per request. Each
+path reports the upstream requests it caused when the server is the stand-in
+(read from its /stats). Intervention log writes go to a temporary file.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOCATIONS = ['London', 'Manchester', 'Birmingham', 'Edinburgh', 'Cardiff']
+
+ANALYSIS_INPUTS = {
+    'rainfall_forecast': 42.0, 'inflow_rate': 320, 'outflow_rate': 180, 'tank_level': 88, 'tank_capacity': 500000,
+    'pump_speed': 1200, 'valve_a_status': 'Partially Open', 'overflow_risk': 'High', 'pump_vibration': 2.2,
+    'valve_delay': 7, 'sensor_score': 6, 'level_drop': 12, 'overflow_duration': 35, 'overflow_count': 4, 'treated': 'No'
+}
+
+
+class PassThroughFlights:
+    """Stands in for SingleFlight/AsyncSingleFlight: every caller makes its own call."""
+
+    def do(self, key, fn):
+        return fn()
+
+
+class AsyncPassThroughFlights:
+    async def do(self, key, coro_fn):
+        return await coro_fn()
+
+
+def upstream_requests():
+    """Requests served so far by the stand-in, or None for a real endpoint."""
+    base_url = os.getenv('OPENAI_BASE_URL', '')
+    if not base_url:
+        return None
+    try:
+        with urllib.request.urlopen(base_url.rstrip('/').removesuffix('/v1') + '/stats', timeout=2) as response:
+            return json.load(response)['requests']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def run_path(name, call, requests, concurrency, settle=None):
+    """Time call(i) for each request; settle(results), if given, waits for any
+    background work they started so it is counted against this path."""
+    latencies, results = [], []
+
+    def timed(i):
+        start = time.perf_counter()
+        results.append(call(i))
+        latencies.append(time.perf_counter() - start)
+
+    upstream_before = upstream_requests()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(requests)))
+    wall = time.perf_counter() - started
+    if settle:
+        settle(results)
+    upstream_after = upstream_requests()
+    upstream = upstream_after - upstream_before if None not in (upstream_before, upstream_after) else 'n/a'
+    print(f'{name:28} {requests / wall:8.1f} req/s   p50 {statistics.median(latencies) * 1000:8.1f} ms   '
+          f'p95 {percentile(latencies, 95) * 1000:8.1f} ms   p99 {percentile(latencies, 99) * 1000:8.1f} ms   '
+          f'upstream {upstream}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the LLM-bound engine paths.')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--cache', action='store_true', help='leave the LLM response cache enabled')
+    parser.add_argument('--coalesce', action='store_true', help='let concurrent identical prompts share one completion')
+    parser.add_argument('--analysis-mode', default='concurrent', choices=['concurrent', 'sequential', 'combined'])
+    args = parser.parse_args()
+
+    if not args.cache:
+        os.environ['WATER_LLM_LLM_CACHE'] = '0'
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, REPO_ROOT)
+    import water_llm_engine
+    import water_llm_engine_2
+
+    water_llm_engine.LOG_FILE = os.path.join(tempfile.mkdtemp(), 'water_llm_log.json')
+    if not args.coalesce:
+        water_llm_engine.gpt_flights = water_llm_engine_2.gpt_flights = PassThroughFlights()
+        water_llm_engine_2.async_gpt_flights = AsyncPassThroughFlights()
+    print(f'LLM endpoint: {os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")}   cache: {"on" if args.cache else "off"}   '
+          f'coalescing: {"on" if args.coalesce else "off"}')
+    run_path('overflow_control', lambda i: water_llm_engine_2.overflow_control(LOCATIONS[i % len(LOCATIONS)]),
+             args.requests, args.concurrency)
+    run_path('overflow_control (deferred)',
+             lambda i: water_llm_engine_2.overflow_control(LOCATIONS[i % len(LOCATIONS)], defer_advisory=True),
+             args.requests, args.concurrency,
+             settle=lambda results: [water_llm_engine_2.get_advisory_job(result['advisory_job_id'], wait=120)
+                                     for result in results if result.get('advisory_job_id')])
+    run_path('generate_contextual_advisory', lambda i: water_llm_engine_2.generate_contextual_advisory(LOCATIONS[i % len(LOCATIONS)]),
+             args.requests, args.concurrency)
+    run_path(f'run_all_analyses ({args.analysis_mode})',
+             lambda i: water_llm_engine.run_all_analyses(dict(ANALYSIS_INPUTS, inflow_rate=ANALYSIS_INPUTS['inflow_rate'] + i),
+                                                         LOCATIONS[i % len(LOCATIONS)], mode=args.analysis_mode),
+             args.requests, args.concurrency)
+
+
+if __name__ == '__main__':
+    main()
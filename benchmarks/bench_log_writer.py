@@ -0,0 +1,79 @@
+# benchmarks/bench_log_writer.py
+"""
+Per-call cost of appending a JSONL record from request threads: opening and
+appending to the file on every call (the old pattern) versus queueing it for
+log_writer's batched background thread.
+
+    python benchmarks/bench_log_writer.py --threads 16 --records 5000
+
+Both variants write to a scratch directory; the queued total includes the
+final flush, so it counts the time to get every record onto disk.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RECORD = {'timestamp': '2025-06-17 05:03:17', 'location': 'London', 'predicted_rainfall_mm': 42.0,
+          'predicted_overflow': True, 'actual_rainfall_mm': 42.0, 'actual_overflow': True, 'match': True}
+
+
+def direct_append(path, record):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def run(label, write, path, threads, records):
+    costs = []
+
+    def produce():
+        local = []
+        for _ in range(records):
+            started = time.perf_counter()
+            write(path, RECORD)
+            local.append(time.perf_counter() - started)
+        costs.extend(local)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=produce) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return label, costs, started
+
+
+def report(label, costs, elapsed):
+    costs.sort()
+    print(f'{label:<8} {len(costs):>8,} records  {elapsed:6.2f} s  per call p50 {costs[len(costs) // 2] * 1e6:7.1f} us  '
+          f'p99 {costs[int(len(costs) * 0.99)] * 1e6:7.1f} us')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark synchronous vs queued log appends.')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--records', type=int, default=5000, help='records per thread')
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_ROOT)
+    from log_writer import LogWriter
+
+    scratch = tempfile.mkdtemp()
+    label, costs, started = run('direct', direct_append, os.path.join(scratch, 'direct.jsonl'), args.threads, args.records)
+    report(label, costs, time.perf_counter() - started)
+
+    writer = LogWriter()
+    label, costs, started = run('queued', writer.write_json, os.path.join(scratch, 'queued.jsonl'), args.threads, args.records)
+    writer.flush(timeout=300)
+    report(label, costs, time.perf_counter() - started)
+    print(f'writer   {writer.stats()}')
+    writer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# benchmarks/bench_risk_engine.py
+"""
+Throughput and parity check for the vectorised risk rules in risk_batch.py
+against the scalar rule functions in water_llm_engine_2:
+
+    python benchmarks/bench_risk_engine.py --rows 5000000 --parity-rows 200000
+
+Rows are random rainfall/tank-fill pairs plus every threshold value, values
+just either side of them, and NaN. --rules checks a per-location rule set
+instead of the defaults. Parity is checked on the first
+--parity-rows rows (all of them if 0); any mismatch exits non-zero.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THRESHOLDS = [10, 20, 75, 80, 90, 100]
+
+
+def make_rows(n, seed, thresholds=THRESHOLDS):
+    rng = np.random.default_rng(seed)
+    edges = np.array([v + d for v in thresholds for d in (-1e-9, 0, 1e-9)] + [0, -5, np.nan, np.inf])
+    grid_rain, grid_fill = np.meshgrid(edges, edges)
+    rain = np.concatenate([grid_rain.ravel(), rng.uniform(0, 150, n)])
+    fill = np.concatenate([grid_fill.ravel(), rng.uniform(0, 110, n)])
+    return rain, fill
+
+
+def scalar_rows(engine, rain, fill, rules):
+    for r, f in zip(rain.tolist(), fill.tolist()):
+        overflow = engine.predict_overflow(r, f, rules)
+        yield (engine.calculate_overflow_risk(r, f, rules), overflow, engine.dynamic_control_advice(f, rules),
+               engine.compliance_check(r, overflow, rules))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the vectorised risk rules.')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--parity-rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--rules', default='', help='JSON threshold overrides, as stored in threshold_rules')
+    args = parser.parse_args()
+
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, REPO_ROOT)
+    import risk_batch
+    import water_llm_engine_2 as engine
+    from threshold_rules import compile_rules
+    rules = compile_rules(args.rules)
+
+    rain, fill = make_rows(args.rows, args.seed, sorted(set(THRESHOLDS) | set(rules.thresholds.values())))
+    started = time.perf_counter()
+    batch = risk_batch.evaluate(rain, fill, rules)
+    vector_s = time.perf_counter() - started
+    print(f'vectorised   {len(rain):>12,} rows  {vector_s * 1000:9.1f} ms  {len(rain) / vector_s:14,.0f} rows/s')
+
+    n = len(rain) if args.parity_rows == 0 else min(args.parity_rows, len(rain))
+    started = time.perf_counter()
+    expected = list(scalar_rows(engine, rain[:n], fill[:n], rules))
+    scalar_s = time.perf_counter() - started
+    print(f'scalar       {n:>12,} rows  {scalar_s * 1000:9.1f} ms  {n / scalar_s:14,.0f} rows/s')
+
+    decoded = zip(risk_batch.risk_labels(batch['risk'][:n]).tolist(), batch['overflow'][:n].tolist(),
+                  risk_batch.advice_labels(batch['advice'][:n]).tolist(),
+                  risk_batch.compliance_labels(batch['compliant'][:n]).tolist())
+    mismatches = [(i, want, got) for i, (want, got) in enumerate(zip(expected, decoded)) if tuple(want) != tuple(got)]
+    print(f'parity       {n:>12,} rows  {len(mismatches)} mismatches  speed-up x{(len(rain) / vector_s) / (n / scalar_s):.0f}')
+    for i, want, got in mismatches[:10]:
+        print(f'  row {i}: rain={rain[i]!r} fill={fill[i]!r} scalar={want} batch={got}')
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# benchmarks/bench_startup.py
+"""
+Cold-start benchmark for the Water LLM API.
+
+Each run starts a fresh interpreter, times ``import main`` and then the first
+ASGI request against ``main:app`` (lifespan startup included), and records
+which heavyweight dependencies ended up imported. Usage:
+
+    python benchmarks/bench_startup.py --runs 10 --path /
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['openai', 'httpx', 'requests', 'pandas', 'paho', 'opcua', 'pymodbus']
+
+PROBE = r'''
+import asyncio, json, sys, time
+
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+heavy = json.loads(sys.argv[2])
+loaded = [m for m in heavy if m in sys.modules]
+
+async def first_request(path):
+    events = []
+    async def send(message):
+        events.append(message)
+    lifespan_queue = asyncio.Queue()
+    await lifespan_queue.put({'type': 'lifespan.startup'})
+    lifespan = asyncio.create_task(main.app({'type': 'lifespan', 'asgi': {'version': '3.0'}, 'state': {}}, lifespan_queue.get, send))
+    while not any(e['type'].startswith('lifespan.startup.') for e in events):
+        await asyncio.sleep(0)
+    request_sent = False
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await asyncio.Event().wait()
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+             'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+             'headers': [(b'host', b'bench')], 'client': ('127.0.0.1', 0), 'server': ('bench', 80), 'state': {}}
+    await main.app(scope, receive, send)
+    status = next(e['status'] for e in events if e['type'] == 'http.response.start')
+    await lifespan_queue.put({'type': 'lifespan.shutdown'})
+    await lifespan
+    return status
+
+status = asyncio.run(first_request(sys.argv[1]))
+t2 = time.perf_counter()
+print(json.dumps({'import_s': t1 - t0, 'first_request_s': t2 - t1, 'status': status, 'loaded': loaded,
+                  'loaded_after_request': [m for m in heavy if m in sys.modules]}))
+'''
+
+
+def run_once(path):
+    out = subprocess.run([sys.executable, '-c', PROBE, path, json.dumps(HEAVY_MODULES)], cwd=REPO_ROOT,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/')
+    args = parser.parse_args()
+
+    samples = [run_once(args.path) for _ in range(args.runs)]
+    for key in ('import_s', 'first_request_s'):
+        values = [s[key] for s in samples]
+        print(f'{key:16} median {statistics.median(values) * 1000:8.1f} ms   min {min(values) * 1000:8.1f} ms   max {max(values) * 1000:8.1f} ms')
+    print(f'status           {samples[-1]["status"]}')
+    print(f'loaded at import {", ".join(samples[-1]["loaded"]) or "none of " + ", ".join(HEAVY_MODULES)}')
+    print(f'after request    {", ".join(samples[-1]["loaded_after_request"]) or "none"}')
+
+
+if __name__ == '__main__':
+    main()
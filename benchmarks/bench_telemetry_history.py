@@ -0,0 +1,72 @@
+# benchmarks/bench_telemetry_history.py
+"""
+Ingest benchmark for telemetry_history: several request-like threads enqueue
+points while the background writer group-commits them to a scratch database.
+
+    python benchmarks/bench_telemetry_history.py --threads 8 --points 50000
+
+Reports the per-call cost seen by the producing threads and the sustained
+committed points per second, then times a range query on the result.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOCATIONS = ['London', 'Manchester', 'Birmingham', 'Edinburgh', 'Cardiff']
+SIGNALS = ['sensors.tank_fill_percent', 'sensors.inflow_rate_lps', 'weather.rainfall_mm', 'risk.level']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark durable telemetry ingest.')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--points', type=int, default=25000, help='points per thread')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_ROOT)
+    from telemetry_history import TelemetryHistory
+
+    history = TelemetryHistory(os.path.join(tempfile.mkdtemp(), 'telemetry_history.db'), batch_size=args.batch_size,
+                               queue_size=args.threads * args.points + 1)
+    call_costs = []
+
+    def produce(worker):
+        costs = []
+        base_ts = int(time.time() * 1000)
+        for i in range(args.points):
+            started = time.perf_counter()
+            history.record(LOCATIONS[(worker + i) % len(LOCATIONS)], SIGNALS[i % len(SIGNALS)], float(i), base_ts + i)
+            costs.append(time.perf_counter() - started)
+        call_costs.extend(costs)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=produce, args=(worker,)) for worker in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    enqueued = time.perf_counter() - started
+    history.flush(timeout=300)
+    committed = time.perf_counter() - started
+    total = args.threads * args.points
+    stats = history.stats()
+    call_costs.sort()
+    print(f'producers    {total:>10,} points  {enqueued:7.2f} s  record() p50 {statistics.median(call_costs) * 1e6:6.1f} us  '
+          f'p99 {call_costs[int(len(call_costs) * 0.99)] * 1e6:6.1f} us')
+    print(f'committed    {stats["written"]:>10,} points  {committed:7.2f} s  {stats["written"] / committed:12,.0f} points/s  '
+          f'{stats["batches"]} batches  dropped {stats["dropped"]}')
+
+    started = time.perf_counter()
+    points = history.query('London', 'sensors.tank_fill_percent', limit=500)
+    print(f'range query  {len(points):>10,} points  {(time.perf_counter() - started) * 1000:7.2f} ms')
+    history.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+# config_store.py
+"""
+Process-wide caches for the site configuration the Water LLM engine reads on
+every request.
+"""
+
+import csv
+import os
+import sqlite3
+import threading
+import time
+
+CONFIG_REFRESH_INTERVAL = float(os.getenv('WATER_LLM_CONFIG_REFRESH', '0.5'))
+
+
+class IntegrationConfigCache:
+    """All integration_config rows held in memory and indexed by location.
+
+    table selects another location-keyed table in the same database; a table
+    that does not exist reads as empty until it is created.
+
+    One long-lived read connection is kept open. At most every refresh_interval
+    seconds it checks ``PRAGMA data_version`` (bumped by commits from any other
+    connection, e.g. integration_settings.py) and the file's inode/mtime (catches
+    the database being replaced), and reloads the table only when either moved.
+    """
+
+    def __init__(self, db_path, refresh_interval=CONFIG_REFRESH_INTERVAL, table='integration_config'):
+        self.db_path = db_path
+        self.table = table
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._conn = None
+        self._file_id = None
+        self._version = None
+        self._rows = None
+        self._checked_at = 0.0
+
+    def _open(self, file_id):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._file_id = file_id
+        self._version = None
+
+    def _load(self):
+        try:
+            cursor = self._conn.execute(f'SELECT * FROM {self.table}')
+        except sqlite3.OperationalError:
+            # Optional per-location tables (e.g. threshold_rules) may not exist yet.
+            return {}
+        columns = [desc[0] for desc in cursor.description]
+        return {row['location']: row for row in (dict(zip(columns, values)) for values in cursor.fetchall())}
+
+    def _refresh_if_stale(self):
+        now = time.monotonic()
+        if self._rows is not None and now - self._checked_at < self.refresh_interval:
+            return
+        st = os.stat(self.db_path)
+        file_id = (st.st_dev, st.st_ino)
+        if self._conn is None or file_id != self._file_id:
+            self._open(file_id)
+        data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        version = (data_version, st.st_mtime_ns, st.st_size)
+        if self._rows is None or version != self._version:
+            self._rows = self._load()
+            self._version = version
+        self._checked_at = now
+
+    def get(self, location):
+        """Config row for a location as a fresh dict, or {} if it is not configured."""
+        with self._lock:
+            self._refresh_if_stale()
+            row = self._rows.get(location)
+        return dict(row) if row else {}
+
+    def locations(self):
+        """Every configured location, in table order."""
+        with self._lock:
+            self._refresh_if_stale()
+            return list(self._rows)
+
+    def invalidate(self):
+        """Force a reload on the next lookup."""
+        with self._lock:
+            self._rows = None
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = None
+            self._rows = None
+
+
+def parse_number(value):
+    """Parse a numeric CSV cell to int when integral, float otherwise."""
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+class CsvConfigRegistry:
+    """A per-location config CSV parsed once into compact per-location indexes.
+
+    Rows are kept as tuples grouped by their ``location`` column, so a lookup is
+    a dict hit plus building the (small) result. The file is re-parsed only when
+    its mtime or size changes, checked at most every refresh_interval seconds.
+    """
+
+    def __init__(self, path, converters=None, refresh_interval=CONFIG_REFRESH_INTERVAL):
+        self.path = path
+        self.converters = converters or {}
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._version = None
+        self._columns = ()
+        self._index = None
+        self._checked_at = 0.0
+
+    def _load(self):
+        with open(self.path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            columns = tuple(name.strip() for name in next(reader))
+            location_pos = columns.index('location')
+            converters = [(pos, self.converters[name]) for pos, name in enumerate(columns) if name in self.converters]
+            index = {}
+            for values in reader:
+                if not values:
+                    continue
+                for pos, convert in converters:
+                    values[pos] = convert(values[pos])
+                index.setdefault(values[location_pos], []).append(tuple(values))
+        return columns, index
+
+    def _refresh_if_stale(self):
+        now = time.monotonic()
+        if self._index is not None and now - self._checked_at < self.refresh_interval:
+            return
+        st = os.stat(self.path)
+        version = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if self._index is None or version != self._version:
+            self._columns, self._index = self._load()
+            self._version = version
+        self._checked_at = now
+
+    def rows(self, location, columns=None):
+        """Rows for a location as dicts, optionally restricted to the given columns."""
+        with self._lock:
+            self._refresh_if_stale()
+            names = self._columns
+            entries = self._index.get(location, ())
+        if columns is None:
+            return [dict(zip(names, entry)) for entry in entries]
+        positions = [names.index(name) for name in columns]
+        return [{name: entry[pos] for name, pos in zip(columns, positions)} for entry in entries]
+
+    def locations(self):
+        """Every location present in the file."""
+        with self._lock:
+            self._refresh_if_stale()
+            return list(self._index)
@@ -0,0 +1,288 @@
+# job_store.py
+"""
+Registries of background jobs for the Water LLM API.
+
+A job is created when work is handed off, moves through pending -> running ->
+done/failed, and can be read back by id or waited on. Finished jobs are kept
+for a TTL so clients can collect results, and the registry is size bounded.
+
+JobStore keeps jobs in process memory. SqliteJobStore keeps them in a SQLite
+file shared by every worker on the host, so a job can be read from any worker
+and create_unique lets a retried trigger find the job already under way.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+FINISHED = (DONE, FAILED)
+
+
+class _Job:
+    __slots__ = ('id', 'kind', 'status', 'result', 'error', 'meta', 'created_at', 'updated_at', 'finished')
+
+    def __init__(self, kind, meta):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.meta = meta
+        self.created_at = self.updated_at = time.time()
+        self.finished = threading.Event()
+
+    def snapshot(self):
+        return {'job_id': self.id, 'kind': self.kind, 'status': self.status, 'result': self.result,
+                'error': self.error, 'created_at': self.created_at, 'updated_at': self.updated_at, **self.meta}
+
+
+class JobStore:
+    """Thread-safe job registry; every accessor returns plain dict snapshots."""
+
+    def __init__(self, ttl=3600, max_jobs=10000):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, kind, **meta):
+        """Register a pending job and return its id."""
+        job = _Job(kind, meta)
+        with self._lock:
+            self._prune(job.created_at)
+            self._jobs[job.id] = job
+        return job.id
+
+    def _prune(self, now):
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished.is_set() and now - job.updated_at > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+        # Over the bound, drop the oldest finished jobs first; running work is never forgotten.
+        if len(self._jobs) >= self.max_jobs:
+            finished = sorted((job for job in self._jobs.values() if job.finished.is_set()), key=lambda job: job.updated_at)
+            for job in finished[:len(self._jobs) - self.max_jobs + 1]:
+                del self._jobs[job.id]
+
+    def _set(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            meta = fields.pop('meta', None)
+            for name, value in fields.items():
+                setattr(job, name, value)
+            if meta:
+                job.meta.update(meta)
+            job.updated_at = time.time()
+            return job
+
+    def start(self, job_id):
+        self._set(job_id, status=RUNNING)
+
+    def update(self, job_id, **meta):
+        """Merge progress fields into a job's metadata."""
+        self._set(job_id, meta=meta)
+
+    def finish(self, job_id, result):
+        job = self._set(job_id, status=DONE, result=result)
+        if job is not None:
+            job.finished.set()
+
+    def fail(self, job_id, error):
+        job = self._set(job_id, status=FAILED, error=str(error))
+        if job is not None:
+            job.finished.set()
+
+    def get(self, job_id):
+        """Snapshot of a job, or None if the id is unknown or has expired."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.snapshot() if job is not None else None
+
+    def wait(self, job_id, timeout=None):
+        """Block until the job finishes or timeout elapses, then return its snapshot."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        job.finished.wait(timeout)
+        return self.get(job_id)
+
+    async def wait_async(self, job_id, timeout=None, poll_interval=0.05):
+        """Coroutine form of wait that never parks a worker thread."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not job.finished.is_set() and (deadline is None or time.monotonic() < deadline):
+            await asyncio.sleep(poll_interval)
+        return self.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+
+class SqliteJobStore:
+    """JobStore with the same accessors, kept in SQLite and shared across processes.
+
+    Results and metadata are stored as JSON. Waiting polls the table, since the
+    job may be running in another process.
+    """
+
+    def __init__(self, db_path, ttl=3600, max_jobs=10000, poll_interval=0.1):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT, unique_key TEXT, status TEXT, '
+                         'result TEXT, error TEXT, meta TEXT, created_at REAL, updated_at REAL)')
+            # At most one unfinished job per unique key, whichever process creates it.
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_unfinished_key ON jobs (unique_key) "
+                         "WHERE unique_key IS NOT NULL AND status IN ('pending', 'running')")
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_updated_at ON jobs (updated_at)')
+            self._conn = conn
+        return self._conn
+
+    def create(self, kind, **meta):
+        """Register a pending job and return its id."""
+        return self.create_unique(kind, None, **meta)[0]
+
+    def create_unique(self, kind, key, stale_after=None, **meta):
+        """Register a pending job unless one for key is unfinished; returns (job_id, created).
+
+        An unfinished job not updated for stale_after seconds is taken to have
+        lost its worker: it is failed and replaced.
+        """
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            conn = self._db()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._prune(conn, now)
+                if key is not None:
+                    row = conn.execute("SELECT id, updated_at FROM jobs WHERE unique_key=? AND status IN ('pending', 'running')",
+                                       (key,)).fetchone()
+                    if row is not None and (stale_after is None or now - row[1] < stale_after):
+                        conn.execute('COMMIT')
+                        return row[0], False
+                    if row is not None:
+                        conn.execute('UPDATE jobs SET status=?, error=?, updated_at=? WHERE id=?',
+                                     (FAILED, f'no progress for {stale_after}s; worker lost', now, row[0]))
+                conn.execute('INSERT INTO jobs (id, kind, unique_key, status, meta, created_at, updated_at) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)', (job_id, kind, key, PENDING, json.dumps(meta, default=str), now, now))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return job_id, True
+
+    def unfinished(self, key, stale_after=None):
+        """Id of the pending or running job for key, or None."""
+        with self._lock:
+            row = self._db().execute("SELECT id, updated_at FROM jobs WHERE unique_key=? AND status IN ('pending', 'running')",
+                                     (key,)).fetchone()
+        if row is None or (stale_after is not None and time.time() - row[1] >= stale_after):
+            return None
+        return row[0]
+
+    def _prune(self, conn, now):
+        conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (now - self.ttl,))
+        count = conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+        # Over the bound, drop the oldest finished jobs first; running work is never forgotten.
+        if count >= self.max_jobs:
+            conn.execute("DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status IN ('done', 'failed') "
+                         'ORDER BY updated_at LIMIT ?)', (count - self.max_jobs + 1,))
+
+    def _set(self, job_id, meta=None, **fields):
+        with self._lock:
+            conn = self._db()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if meta:
+                    row = conn.execute('SELECT meta FROM jobs WHERE id=?', (job_id,)).fetchone()
+                    if row is not None:
+                        fields['meta'] = json.dumps(dict(json.loads(row[0]), **meta), default=str)
+                fields['updated_at'] = time.time()
+                assignments = ', '.join(f'{name}=?' for name in fields)
+                conn.execute(f'UPDATE jobs SET {assignments} WHERE id=?', (*fields.values(), job_id))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def start(self, job_id):
+        self._set(job_id, status=RUNNING)
+
+    def update(self, job_id, **meta):
+        """Merge progress fields into a job's metadata."""
+        self._set(job_id, meta=meta)
+
+    def finish(self, job_id, result):
+        self._set(job_id, status=DONE, result=json.dumps(result, default=str))
+
+    def fail(self, job_id, error):
+        self._set(job_id, status=FAILED, error=str(error))
+
+    def get(self, job_id):
+        """Snapshot of a job, or None if the id is unknown or has expired."""
+        with self._lock:
+            row = self._db().execute('SELECT id, kind, status, result, error, meta, created_at, updated_at FROM jobs '
+                                     'WHERE id=?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job_id, kind, status, result, error, meta, created_at, updated_at = row
+        return {'job_id': job_id, 'kind': kind, 'status': status, 'result': json.loads(result) if result else None,
+                'error': error, 'created_at': created_at, 'updated_at': updated_at, **json.loads(meta)}
+
+    def wait(self, job_id, timeout=None):
+        """Block until the job finishes or timeout elapses, then return its snapshot."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        job = self.get(job_id)
+        while job is not None and job['status'] not in FINISHED and (deadline is None or time.monotonic() < deadline):
+            time.sleep(self.poll_interval)
+            job = self.get(job_id)
+        return job
+
+    async def get_async(self, job_id):
+        """get() on the default executor, off the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, job_id)
+
+    async def wait_async(self, job_id, timeout=None):
+        """Coroutine form of wait; each poll reads the table on the default executor."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        job = await self.get_async(job_id)
+        while job is not None and job['status'] not in FINISHED and (deadline is None or time.monotonic() < deadline):
+            await asyncio.sleep(self.poll_interval)
+            job = await self.get_async(job_id)
+        return job
+
+    def stats(self):
+        with self._lock:
+            return dict(self._db().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,208 @@
+# llm_cache.py
+"""
+Two-tier response cache for GPT completions.
+
+Entries are keyed on (model, system prompt, user prompt, temperature). Lookups
+hit an in-process LRU first, then a SQLite file shared by every worker on the
+host. Each prompt family has its own TTL, and both tiers are size bounded.
+
+Disk-tier reads never write: hits record their access time in memory and
+those timestamps reach SQLite in one batch with the next store (or once
+LLM_CACHE_TOUCH_BATCH hits have accumulated), and expired rows are left for
+eviction to drop. Async callers go through the executor, never the event loop.
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+LLM_CACHE_ENABLED = os.getenv('WATER_LLM_LLM_CACHE', '1') != '0'
+LLM_CACHE_PATH = os.getenv('WATER_LLM_LLM_CACHE_PATH', 'logs/llm_cache.db')
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv('WATER_LLM_LLM_CACHE_MEMORY_ENTRIES', '1024'))
+LLM_CACHE_DISK_ENTRIES = int(os.getenv('WATER_LLM_LLM_CACHE_DISK_ENTRIES', '50000'))
+LLM_CACHE_TOUCH_BATCH = int(os.getenv('WATER_LLM_LLM_CACHE_TOUCH_BATCH', '256'))
+
+# Seconds a completion stays valid, per prompt family. Advisories keyed on a risk
+# level change slowly; prompts embedding live readings go stale quickly.
+FAMILY_TTLS = {
+    'overflow_advisory': 3600,
+    'weather_forecast': 1800,
+    'contextual_advisory': 300,
+    'analysis': 300,
+    'risk_action': 3600,
+    'default': 900,
+}
+
+
+def cache_key(model, system_prompt, prompt, temperature):
+    """Stable digest of everything that determines a completion."""
+    material = '\x1f'.join([model, system_prompt, prompt, repr(float(temperature))])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def flight_key(model, system_prompt, prompt, temperature):
+    """Coalescing key: like cache_key but insensitive to whitespace differences in the prompt."""
+    return cache_key(model, system_prompt, ' '.join(prompt.split()), temperature)
+
+
+class LLMResponseCache:
+    """In-memory LRU in front of a size-bounded SQLite store."""
+
+    def __init__(self, db_path=LLM_CACHE_PATH, memory_entries=LLM_CACHE_MEMORY_ENTRIES,
+                 disk_entries=LLM_CACHE_DISK_ENTRIES, family_ttls=None, enabled=LLM_CACHE_ENABLED):
+        self.db_path = db_path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.family_ttls = dict(FAMILY_TTLS, **(family_ttls or {}))
+        self.enabled = enabled
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._disk_count = 0
+        self._touched = {}
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    def _db(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, family TEXT, response TEXT, '
+                         'created_at REAL, expires_at REAL, last_access REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)')
+            conn.commit()
+            self._conn = conn
+            self._disk_count = conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+        return self._conn
+
+    def ttl_for(self, family):
+        return self.family_ttls.get(family, self.family_ttls['default'])
+
+    def _remember(self, key, response, expires_at):
+        self._memory[key] = (response, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Cached response for a key, or None on a miss or expired entry."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return entry[0]
+                del self._memory[key]
+            conn = self._db()
+            row = conn.execute('SELECT response, expires_at FROM llm_cache WHERE key=?', (key,)).fetchone()
+            if row is None or row[1] <= now:
+                # Expired rows stay until the next put replaces or evicts them.
+                self._stats['misses'] += 1
+                return None
+            self._touched[key] = now
+            if len(self._touched) >= LLM_CACHE_TOUCH_BATCH:
+                self._flush_touched(conn)
+                conn.commit()
+            self._remember(key, row[0], row[1])
+            self._stats['disk_hits'] += 1
+            return row[0]
+
+    def put(self, key, response, family='default'):
+        """Store a response in both tiers under its family TTL."""
+        if not self.enabled:
+            return
+        now = time.time()
+        expires_at = now + self.ttl_for(family)
+        with self._lock:
+            self._remember(key, response, expires_at)
+            conn = self._db()
+            existed = conn.execute('SELECT 1 FROM llm_cache WHERE key=?', (key,)).fetchone() is not None
+            conn.execute('INSERT OR REPLACE INTO llm_cache (key, family, response, created_at, expires_at, last_access) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', (key, family, response, now, expires_at, now))
+            if not existed:
+                self._disk_count += 1
+            self._touched.pop(key, None)
+            self._flush_touched(conn)
+            if self._disk_count > self.disk_entries:
+                self._evict(conn, now)
+            conn.commit()
+            self._stats['stores'] += 1
+
+    def _flush_touched(self, conn):
+        """Write buffered disk-hit access times in one statement; the caller commits."""
+        if self._touched:
+            conn.executemany('UPDATE llm_cache SET last_access=? WHERE key=?',
+                             [(accessed, key) for key, accessed in self._touched.items()])
+            self._touched = {}
+
+    def _evict(self, conn, now):
+        """Drop expired rows, then least recently used rows down to 90% of the bound."""
+        conn.execute('DELETE FROM llm_cache WHERE expires_at <= ?', (now,))
+        count = conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+        excess = count - int(self.disk_entries * 0.9)
+        if excess > 0:
+            conn.execute('DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access LIMIT ?)', (excess,))
+        self._disk_count = conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+        self._stats['evictions'] += count - self._disk_count
+
+    def discard(self, key):
+        """Forget one entry, e.g. a completion that turned out to be unusable."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._memory.pop(key, None)
+            self._touched.pop(key, None)
+            cursor = self._db().execute('DELETE FROM llm_cache WHERE key=?', (key,))
+            self._conn.commit()
+            self._disk_count -= cursor.rowcount
+
+    def get_or_compute(self, model, system_prompt, prompt, temperature, family, compute):
+        """Return a cached completion, or call compute() and cache its result unless it is empty."""
+        key = cache_key(model, system_prompt, prompt, temperature)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        response = compute()
+        if response:
+            self.put(key, response, family)
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._touched = {}
+            self._db().execute('DELETE FROM llm_cache')
+            self._conn.commit()
+            self._disk_count = 0
+
+    async def get_async(self, key):
+        """get() on the default executor, so a slow SQLite lock never stalls the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, key)
+
+    async def put_async(self, key, response, family='default'):
+        """put() on the default executor."""
+        await asyncio.get_running_loop().run_in_executor(None, self.put, key, response, family)
+
+    def stats(self):
+        """Hit/miss counters, hit rate and tier sizes."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+            stats['disk_entries'] = self._disk_count
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+llm_cache = LLMResponseCache()
@@ -0,0 +1,243 @@
+# log_aggregates.py
+"""
+Materialised aggregates over the intervention log for the reporting functions
+in water_llm_engine.
+
+Rather than rescanning every logged entry, the store folds each new entry into
+SQLite tables next to the log (``water_llm_log.json.agg``):
+
+    zone_counts  per (kind, location) counts behind recommend_infrastructure_upgrades
+    breaches     one row per compliance breach behind generate_regulatory_report
+    rollups      per (day, location) totals of entries, breaches and each alert kind
+
+The store follows the sidecar offset index (log_index.py) by sequence number, so
+every entry is applied exactly once however many processes append or read, and
+a rebuilt index (truncated or rewritten log) triggers a rebuild here too.
+
+    python log_aggregates.py rebuild
+    python log_aggregates.py upgrades
+    python log_aggregates.py report --location London
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from log_index import LogIndex, timestamp_key
+
+logger = logging.getLogger('WaterLLM')
+
+# Label in recommend_infrastructure_upgrades, input field, and the value it must exceed.
+UPGRADE_ZONES = {
+    'High Vibration Zones': ('pump_vibration', 2.0),
+    'Frequent Valve Delay Zones': ('valve_delay', 5),
+    'Potential Leak Zones': ('level_drop', 10),
+}
+ROLLUP_COLUMNS = {'High Vibration Zones': 'vibration', 'Frequent Valve Delay Zones': 'valve_delay',
+                  'Potential Leak Zones': 'level_drop'}
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS zone_counts (kind TEXT NOT NULL, location TEXT, count INTEGER NOT NULL, '
+    'first_seq INTEGER NOT NULL, PRIMARY KEY (kind, location))',
+    'CREATE TABLE IF NOT EXISTS breaches (seq INTEGER PRIMARY KEY, ts TEXT, location TEXT, detail TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS idx_breaches_location_ts ON breaches (location, ts)',
+    'CREATE TABLE IF NOT EXISTS rollups (bucket TEXT NOT NULL, location TEXT, entries INTEGER NOT NULL DEFAULT 0, '
+    'breaches INTEGER NOT NULL DEFAULT 0, vibration INTEGER NOT NULL DEFAULT 0, valve_delay INTEGER NOT NULL DEFAULT 0, '
+    'level_drop INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (bucket, location))',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)',
+]
+
+
+def upgrade_zones(entry):
+    """Labels of UPGRADE_ZONES an entry's inputs exceed."""
+    inputs = entry.get('inputs') or {}
+    zones = []
+    for label, (field, threshold) in UPGRADE_ZONES.items():
+        value = inputs.get(field, 0)
+        if isinstance(value, (int, float)) and value > threshold:
+            zones.append(label)
+    return zones
+
+
+def breach_record(entry):
+    """The regulatory report row for an entry, or None if it is not a breach."""
+    results = entry.get('results') or {}
+    compliance = results.get('Compliance Check', '')
+    if not isinstance(compliance, str) or 'breach' not in compliance.lower():
+        return None
+    inputs = entry.get('inputs') or {}
+    return {
+        'timestamp': entry.get('timestamp'),
+        'location': entry.get('location'),
+        'overflow_duration': inputs.get('overflow_duration', 'N/A'),
+        'overflow_count': inputs.get('overflow_count', 'N/A'),
+        'treated': inputs.get('treated', 'N/A'),
+        'compliance_status': results.get('Compliance Check', 'N/A')
+    }
+
+
+class LogAggregates:
+    """Per-location counters, breach list and daily rollups, kept in <log>.agg."""
+
+    def __init__(self, log_path, db_path=None, index=None):
+        self.index = index or LogIndex(log_path)
+        self.db_path = db_path or f'{log_path}.agg'
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+    def refresh(self):
+        """Fold in entries logged since the last refresh; returns how many were applied."""
+        generation = self.index.generation()
+        with self._lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                meta = dict(conn.execute('SELECT key, value FROM meta').fetchall())
+                applied = meta.get('applied_seq', 0)
+                if meta.get('generation', generation) != generation:
+                    logger.warning('⚠️ Intervention log index was rebuilt; rebuilding its aggregates.')
+                    self._clear(conn)
+                    applied = 0
+                count = 0
+                for seq, entry in self.index.iter_since(applied):
+                    if isinstance(entry, dict):
+                        self._apply(conn, seq, entry)
+                    applied = seq
+                    count += 1
+                conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                 [('applied_seq', applied), ('generation', generation)])
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return count
+
+    @staticmethod
+    def _clear(conn):
+        for table in ('zone_counts', 'breaches', 'rollups', 'meta'):
+            conn.execute(f'DELETE FROM {table}')
+
+    @staticmethod
+    def _apply(conn, seq, entry):
+        location = entry.get('location') or ''
+        ts = timestamp_key(entry.get('timestamp'))
+        zones = upgrade_zones(entry)
+        breach = breach_record(entry)
+        for label in zones:
+            conn.execute('INSERT INTO zone_counts (kind, location, count, first_seq) VALUES (?, ?, 1, ?) '
+                         'ON CONFLICT (kind, location) DO UPDATE SET count = count + 1', (label, location, seq))
+        if breach is not None:
+            conn.execute('INSERT INTO breaches (seq, ts, location, detail) VALUES (?, ?, ?, ?)',
+                         (seq, ts, location, json.dumps(breach)))
+        bucket = ts[:10] if ts else ''
+        columns = [ROLLUP_COLUMNS[label] for label in zones]
+        increments = ''.join(f', {column} = {column} + 1' for column in columns)
+        conn.execute('INSERT INTO rollups (bucket, location) VALUES (?, ?) ON CONFLICT (bucket, location) DO NOTHING',
+                     (bucket, location))
+        conn.execute(f'UPDATE rollups SET entries = entries + 1, breaches = breaches + ?{increments} '
+                     'WHERE bucket = ? AND location = ?', (int(breach is not None), bucket, location))
+
+    def rebuild(self):
+        """Re-index the log and recompute every aggregate from scratch."""
+        self.index.rebuild()
+        with self._lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            self._clear(conn)
+            conn.execute('COMMIT')
+        return self.refresh()
+
+    def upgrade_zones(self):
+        """recommend_infrastructure_upgrades' result: {label: {location: count}}."""
+        self.refresh()
+        with self._lock:
+            rows = self._connection().execute('SELECT kind, location, count FROM zone_counts ORDER BY first_seq').fetchall()
+        zones = {label: {} for label in UPGRADE_ZONES}
+        for kind, location, count in rows:
+            zones[kind][location] = count
+        return zones
+
+    def breaches(self, location=None, start=None, end=None):
+        """Breach rows in log order, optionally for one location and/or time range."""
+        self.refresh()
+        clauses, params = [], []
+        if location is not None:
+            clauses.append('location = ?')
+            params.append(location)
+        if start is not None:
+            clauses.append('ts >= ?')
+            params.append(timestamp_key(start))
+        if end is not None:
+            clauses.append('ts <= ?')
+            params.append(timestamp_key(end))
+        sql = 'SELECT detail FROM breaches' + (' WHERE ' + ' AND '.join(clauses) if clauses else '') + ' ORDER BY seq'
+        with self._lock:
+            rows = self._connection().execute(sql, params).fetchall()
+        return [json.loads(detail) for (detail,) in rows]
+
+    def rollups(self, location=None, start=None, end=None):
+        """Daily totals per location, oldest first; start/end are 'YYYY-MM-DD' days."""
+        self.refresh()
+        clauses, params = [], []
+        if location is not None:
+            clauses.append('location = ?')
+            params.append(location)
+        if start is not None:
+            clauses.append('bucket >= ?')
+            params.append(str(start)[:10])
+        if end is not None:
+            clauses.append('bucket <= ?')
+            params.append(str(end)[:10])
+        sql = ('SELECT bucket, location, entries, breaches, vibration, valve_delay, level_drop FROM rollups'
+               + (' WHERE ' + ' AND '.join(clauses) if clauses else '') + ' ORDER BY bucket, location')
+        with self._lock:
+            rows = self._connection().execute(sql, params).fetchall()
+        keys = ('day', 'location', 'entries', 'breaches', 'vibration', 'valve_delay', 'level_drop')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self.index.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain and query intervention log aggregates.')
+    parser.add_argument('--log', default='logs/water_llm_log.json')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rebuild')
+    sub.add_parser('upgrades')
+    for name in ('report', 'rollups'):
+        query = sub.add_parser(name)
+        query.add_argument('--location')
+        query.add_argument('--start')
+        query.add_argument('--end')
+    args = parser.parse_args()
+
+    aggregates = LogAggregates(args.log)
+    if args.command == 'rebuild':
+        print(f'✅ Aggregated {aggregates.rebuild()} entries from {args.log}')
+    elif args.command == 'upgrades':
+        print(json.dumps(aggregates.upgrade_zones(), indent=2))
+    elif args.command == 'report':
+        breaches = aggregates.breaches(args.location, args.start, args.end)
+        print(json.dumps({'total_breaches': len(breaches), 'breach_details': breaches}, indent=2))
+    elif args.command == 'rollups':
+        print(json.dumps(aggregates.rollups(args.location, args.start, args.end), indent=2))
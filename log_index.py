@@ -0,0 +1,288 @@
+# log_index.py
+"""
+Sidecar offset index for the intervention log (logs/water_llm_log.json).
+
+The log is mostly one JSON object per line, but older files begin with a
+pretty-printed JSON array and contain lines glued to it (``]{...}``) or cut
+short. The index records the byte offset, length, timestamp and location of
+every complete top-level object in a SQLite file next to the log
+(``water_llm_log.json.idx``), so readers seek straight to the entries they
+want instead of decoding the whole file.
+
+Each read first indexes whatever was appended since the last one, so the cost
+of a "last N" or filtered read depends on the entries returned, not on the size
+of the log. A truncated or rewritten log is detected and re-indexed.
+
+    python log_index.py tail --last 10
+    python log_index.py rebuild
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+logger = logging.getLogger('WaterLLM')
+
+HEAD_BYTES = 4096
+INSERT_BATCH = 5000
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS entries (seq INTEGER PRIMARY KEY, offset INTEGER NOT NULL, length INTEGER NOT NULL, '
+    'ts TEXT, location TEXT)',
+    'CREATE INDEX IF NOT EXISTS idx_entries_ts ON entries (ts)',
+    'CREATE INDEX IF NOT EXISTS idx_entries_location_ts ON entries (location, ts)',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)',
+]
+
+# A JSON string (which cannot span lines) or a brace outside one.
+_TOKEN = re.compile(rb'"(?:[^"\\\n]|\\.)*"|[{}]')
+
+
+def timestamp_key(value):
+    """Sortable 'YYYY-MM-DD HH:MM:SS' text for a logged timestamp or a datetime filter."""
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value).replace('T', ' ')[:19]
+
+
+def scan_objects(f, offset=0):
+    """Yield (offset, length, obj) for each top-level JSON object from offset on.
+
+    Lines starting with '{' are tried as whole JSON lines first; anything else
+    (pretty-printed or glued entries) is brace-matched. An unfinished object is
+    abandoned when a new line starts with '{'. The generator returns the offset
+    to resume from: the start of an object still open at EOF, otherwise EOF.
+    """
+    f.seek(offset)
+    pos = offset
+    depth, start, parts = 0, None, []
+    for line in f:
+        line_start = pos
+        pos += len(line)
+        if line.startswith(b'{'):
+            if depth:
+                yield start, line_start - start, None
+                depth, parts = 0, []
+            try:
+                yield line_start, len(line), json.loads(line)
+                continue
+            except ValueError:
+                pass
+        elif depth == 0 and b'{' not in line:
+            continue
+        segment = 0
+        for match in _TOKEN.finditer(line):
+            token = match.group()
+            if token == b'{':
+                if depth == 0:
+                    start, segment, parts = line_start + match.start(), match.start(), []
+                depth += 1
+            elif token == b'}' and depth:
+                depth -= 1
+                if depth == 0:
+                    parts.append(line[segment:match.end()])
+                    try:
+                        obj = json.loads(b''.join(parts))
+                    except ValueError:
+                        obj = None
+                    yield start, line_start + match.end() - start, obj
+                    parts = []
+        if depth:
+            parts.append(line[segment:])
+    return start if depth else pos
+
+
+class LogIndex:
+    """Offset index over one JSON log file, kept in <log>.idx."""
+
+    def __init__(self, log_path, index_path=None):
+        self.log_path = log_path
+        self.index_path = index_path or f'{log_path}.idx'
+        self._conn = None
+        self._lock = threading.Lock()
+        self._indexed_size = None
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.index_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.index_path, check_same_thread=False, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+    def _head_digest(self, length):
+        with open(self.log_path, 'rb') as f:
+            return hashlib.sha1(f.read(length)).hexdigest()
+
+    def refresh(self):
+        """Index entries appended since the last refresh; returns how many were added."""
+        size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        if size == self._indexed_size:
+            return 0
+        with self._lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                meta = dict(conn.execute('SELECT key, value FROM meta').fetchall())
+                indexed_to = meta.get('indexed_to', 0)
+                head_len = min(HEAD_BYTES, indexed_to)
+                if size < indexed_to or (head_len and meta.get('head') != self._head_digest(head_len)):
+                    logger.warning(f'⚠️ {self.log_path} was truncated or rewritten; rebuilding its index.')
+                    conn.execute('DELETE FROM entries')
+                    indexed_to, meta['skipped'] = 0, 0
+                    meta['generation'] = meta.get('generation', 0) + 1
+                added = skipped = 0
+                if size > indexed_to:
+                    indexed_to, added, skipped = self._index_from(conn, indexed_to)
+                conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', [
+                    ('indexed_to', indexed_to), ('head', self._head_digest(min(HEAD_BYTES, indexed_to))),
+                    ('skipped', meta.get('skipped', 0) + skipped), ('generation', meta.get('generation', 0))])
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            self._indexed_size = size if indexed_to == size else None
+        if skipped:
+            logger.warning(f'⚠️ Skipped {skipped} malformed entries while indexing {self.log_path}')
+        return added
+
+    def _index_from(self, conn, offset):
+        rows, added, skipped = [], 0, 0
+        with open(self.log_path, 'rb') as f:
+            scanner = scan_objects(f, offset)
+            while True:
+                try:
+                    start, length, obj = next(scanner)
+                except StopIteration as done:
+                    resume = done.value
+                    break
+                if not isinstance(obj, dict):
+                    skipped += 1
+                    continue
+                rows.append((start, length, timestamp_key(obj.get('timestamp')), obj.get('location')))
+                if len(rows) >= INSERT_BATCH:
+                    added += self._insert(conn, rows)
+                    rows = []
+        added += self._insert(conn, rows)
+        return resume, added, skipped
+
+    @staticmethod
+    def _insert(conn, rows):
+        conn.executemany('INSERT INTO entries (offset, length, ts, location) VALUES (?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def rebuild(self):
+        """Drop the index and re-scan the whole log."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            generation = dict(conn.execute('SELECT key, value FROM meta').fetchall()).get('generation', 0)
+            conn.execute('DELETE FROM entries')
+            conn.execute('DELETE FROM meta')
+            conn.execute("INSERT INTO meta (key, value) VALUES ('generation', ?)", (generation + 1,))
+            conn.execute('COMMIT')
+            self._indexed_size = None
+        return self.refresh()
+
+    def _spans(self, last=None, start=None, end=None, location=None):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append('ts >= ?')
+            params.append(timestamp_key(start))
+        if end is not None:
+            clauses.append('ts <= ?')
+            params.append(timestamp_key(end))
+        if location is not None:
+            clauses.append('location = ?')
+            params.append(location)
+        sql = 'SELECT offset, length FROM entries' + (' WHERE ' + ' AND '.join(clauses) if clauses else '')
+        if last is not None:
+            sql += ' ORDER BY seq DESC LIMIT ?'
+            params.append(last)
+        else:
+            sql += ' ORDER BY seq'
+        with self._lock:
+            spans = self._connection().execute(sql, params).fetchall()
+        return spans[::-1] if last is not None else spans
+
+    def iter_entries(self, last=None, start=None, end=None, location=None):
+        """Yield logged entries oldest first, optionally only the last N and/or
+        those in [start, end] (timestamps or datetimes) for one location."""
+        self.refresh()
+        spans = self._spans(last, start, end, location)
+        if not spans:
+            return
+        with open(self.log_path, 'rb') as f:
+            for offset, length in spans:
+                f.seek(offset)
+                yield json.loads(f.read(length))
+
+    def iter_since(self, seq=0):
+        """Yield (seq, entry) for every entry indexed after seq, in log order."""
+        self.refresh()
+        with self._lock:
+            spans = self._connection().execute('SELECT seq, offset, length FROM entries WHERE seq > ? ORDER BY seq',
+                                               (seq,)).fetchall()
+        if not spans:
+            return
+        with open(self.log_path, 'rb') as f:
+            for entry_seq, offset, length in spans:
+                f.seek(offset)
+                yield entry_seq, json.loads(f.read(length))
+
+    def generation(self):
+        """Bumped whenever the index is rebuilt, so followers know to start over."""
+        self.refresh()
+        with self._lock:
+            row = self._connection().execute("SELECT value FROM meta WHERE key='generation'").fetchone()
+        return row[0] if row else 0
+
+    def stats(self):
+        self.refresh()
+        with self._lock:
+            conn = self._connection()
+            meta = dict(conn.execute('SELECT key, value FROM meta').fetchall())
+            entries = conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        return {'entries': entries, 'indexed_bytes': meta.get('indexed_to', 0), 'skipped': meta.get('skipped', 0),
+                'generation': meta.get('generation', 0)}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index and read the intervention log.')
+    parser.add_argument('--log', default='logs/water_llm_log.json')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rebuild')
+    sub.add_parser('stats')
+    tail = sub.add_parser('tail')
+    tail.add_argument('--last', type=int, default=10)
+    tail.add_argument('--location')
+    tail.add_argument('--start')
+    tail.add_argument('--end')
+    args = parser.parse_args()
+
+    index = LogIndex(args.log)
+    if args.command == 'rebuild':
+        print(f'✅ Indexed {index.rebuild()} entries from {args.log}')
+    elif args.command == 'stats':
+        print(json.dumps(index.stats(), indent=2))
+    elif args.command == 'tail':
+        for entry in index.iter_entries(args.last, args.start, args.end, args.location):
+            print(f"{entry.get('timestamp')}  {entry.get('location')}  {entry.get('inputs', {}).get('overflow_risk', 'N/A')}")
@@ -0,0 +1,198 @@
+# log_writer.py
+"""
+Shared background writer for the Water LLM's append-only logs.
+
+Request threads hand lines to ``log_writer.write`` (or records to
+``write_json``) and return at once; a single daemon thread drains the queue and
+appends them to their files in batches, flushing after every batch_size lines
+or flush_interval seconds, whichever comes first. Files are opened per batch,
+so external rotation keeps working.
+
+Python logging goes through the same path: ``queue_logging_handler`` returns a
+QueueHandler for the root logger whose listener formats records onto the
+console and into a batched file sink, so ``logger.info`` never waits on disk.
+
+``flush()`` blocks until everything queued so far is on disk; readers call it
+before reading a file they may have just written. The writer is flushed and
+stopped at interpreter exit, and writes after that go straight to disk.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_BATCH_SIZE = int(os.getenv('WATER_LLM_LOG_BATCH_SIZE', '500'))
+LOG_FLUSH_INTERVAL = float(os.getenv('WATER_LLM_LOG_FLUSH_INTERVAL', '0.2'))
+LOG_QUEUE_SIZE = int(os.getenv('WATER_LLM_LOG_QUEUE_SIZE', '100000'))
+
+_STOP = object()
+
+
+class LogWriter:
+    """Queue-fed, batch-appending writer for any number of log files."""
+
+    def __init__(self, batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL, queue_size=LOG_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Bounded so a stalled disk cannot grow memory without limit; producers
+        # only block once the writer is queue_size lines behind.
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._flush_listeners = {}
+        self._record_listeners = []
+        self._closed = False
+        self._stats = {'lines': 0, 'batches': 0, 'errors': 0}
+        self._failing = set()
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+                    self._thread.start()
+
+    def write(self, path, text):
+        """Queue text (ending in a newline) to be appended to path."""
+        if self._closed:
+            self._append(path, [text])
+            return
+        self._ensure_thread()
+        with self._lock:
+            self._pending[path] += 1
+        self._queue.put((path, text))
+
+    def write_json(self, path, record):
+        """Queue one JSONL record."""
+        self.write(path, json.dumps(record) + '\n')
+
+    def on_flush(self, path, callback):
+        """Call callback() on the writer thread after each batch appended to path."""
+        with self._lock:
+            self._flush_listeners.setdefault(path, {})[callback] = None
+
+    def _run(self):
+        while True:
+            batches, waiters, count, stop = {}, [], 0, False
+            deadline = None
+            while count < self.batch_size:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                path, text = item
+                batches.setdefault(path, []).append(text)
+                count += 1
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            for path, lines in batches.items():
+                self._append(path, lines)
+                with self._lock:
+                    self._pending[path] -= len(lines)
+                    callbacks = list(self._flush_listeners.get(path, ()))
+                for callback in callbacks:
+                    try:
+                        callback()
+                    except Exception as e:
+                        print(f'❌ Flush callback for {path} failed: {e}', file=sys.stderr)
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+
+    def _append(self, path, lines):
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(''.join(lines))
+            self._stats['lines'] += len(lines)
+            self._stats['batches'] += 1
+            self._failing.discard(path)
+        except OSError as e:
+            self._stats['errors'] += 1
+            # Writer failures go to stderr, never through logger: the root logger
+            # writes via this writer, so a failing sink would keep reporting its
+            # own failure. Reported once per path until a write succeeds again.
+            if path not in self._failing:
+                self._failing.add(path)
+                print(f'❌ Failed to append {len(lines)} lines to {path}: {e}', file=sys.stderr)
+
+    def flush(self, path=None, timeout=10):
+        """Block until everything queued so far (for path, or for every file) is written."""
+        if self._thread is None or self._closed:
+            return True
+        with self._lock:
+            if path is not None and not self._pending[path]:
+                return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def queue_logging_handler(self, path, fmt, console=True):
+        """A QueueHandler for the root logger that batches records into path (and echoes them to the console)."""
+        records = queue.SimpleQueue()
+        handlers = [_SinkHandler(self, path)] + ([logging.StreamHandler()] if console else [])
+        for handler in handlers:
+            handler.setFormatter(logging.Formatter(fmt))
+        listener = QueueListener(records, *handlers, respect_handler_level=True)
+        listener.start()
+        self._record_listeners.append(listener)
+        handler = QueueHandler(records)
+        # QueueHandler bakes the message (and any traceback) into the record; the
+        # listener's handlers add the timestamp and level.
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        return handler
+
+    def stats(self):
+        with self._lock:
+            pending = sum(self._pending.values())
+        return dict(self._stats, pending=pending)
+
+    def close(self):
+        """Drain logging, write everything queued and stop the thread."""
+        for listener in self._record_listeners:
+            listener.stop()
+        self._record_listeners = []
+        if self._closed:
+            return
+        # Later writes go straight to disk rather than behind the stop marker.
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+
+
+class _SinkHandler(logging.Handler):
+    """Logging handler that appends formatted records through a LogWriter."""
+
+    def __init__(self, writer, path):
+        super().__init__()
+        self.writer = writer
+        self.path = path
+
+    def emit(self, record):
+        try:
+            self.writer.write(self.path, self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+
+log_writer = LogWriter()
+atexit.register(log_writer.close)
@@ -1,49 +1,171 @@
-from fastapi import FastAPI, Query
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-
-from water_llm_engine_2 import (
-    overflow_control,
-    run_all_analyses,
-    generate_contextual_advisory,
-    storm_response_coordinator
-)
-
-app = FastAPI()
-
-# ✅ CORS Fix
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:8080"],  # or ["*"] in dev
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# ✅ POST Input Schema
-class StormRequest(BaseModel):
-    location: str
-    rainfall_mm: float
-    tank_fill_percent: float
-    river_fill_percent: float
-
-@app.get("/")
-def root():
-    return {"message": "Water LLM API is running"}
-
-@app.get("/overflow")
-def overflow(location: str = Query("London")):
-    return overflow_control(location)
-
-@app.get("/analyse")
-def analyse(location: str = Query("London")):
-    return run_all_analyses(location)
-
-@app.get("/advisory")
-def advisory(location: str = Query("London")):
-    return generate_contextual_advisory(location)
-
-# ✅ FIXED: POST + JSON body
-@app.post("/storm")
-def storm(req: StormRequest):
-    return storm_response_coordinator(req.location)
+import json
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import List, Optional, Union
+
+from llm_cache import llm_cache
+from protocol_sessions import protocol_pool
+from storm_leases import storm_leases
+from telemetry_history import telemetry_history
+from log_writer import log_writer
+from water_llm_engine_2 import (
+    overflow_control_async,
+    get_advisory_job_async,
+    run_all_analyses_async,
+    generate_contextual_advisory_async,
+    stream_contextual_advisory_async,
+    forecast_weather_with_gpt,
+    stream_weather_forecast_async,
+    submit_storm_job,
+    get_storm_job_async,
+    storm_jobs,
+    StormQueueFull,
+    run_batch,
+    get_threshold_rules,
+    recent_telemetry,
+    telemetry_history_range,
+    close_async_http_client,
+    configure_logging,
+    gpt_flights,
+    async_gpt_flights
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_logging()
+    yield
+    await close_async_http_client()
+    protocol_pool.close_all()
+    storm_leases.close()
+    storm_jobs.close()
+    telemetry_history.close()
+    log_writer.flush()
+
+app = FastAPI(lifespan=lifespan)
+
+# ✅ CORS Fix
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:8080"],  # or ["*"] in dev
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+def sse_response(chunks):
+    """Wrap an async text generator as a server-sent-events stream ending with a 'done' event,
+    or with an 'error' event if the generator fails part-way."""
+    async def events():
+        try:
+            async for chunk in chunks:
+                yield f"data: {json.dumps(chunk)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+            return
+        yield "event: done\ndata: {}\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ✅ POST Input Schema
+class StormRequest(BaseModel):
+    location: str
+    rainfall_mm: float
+    tank_fill_percent: float
+    river_fill_percent: float
+
+class BatchRequest(BaseModel):
+    locations: Union[List[str], str] = "all"
+    concurrency: Optional[int] = None
+
+@app.get("/")
+def root():
+    return {"message": "Water LLM API is running"}
+
+@app.get("/llm/cache/stats")
+def llm_cache_stats():
+    stats = llm_cache.stats()
+    stats['coalescing'] = {'sync': gpt_flights.stats(), 'async': async_gpt_flights.stats()}
+    return stats
+
+# Effective threshold rules for a location (defaults, then '*', then the location's own row).
+@app.get("/rules")
+def threshold_rules(location: str = Query("London")):
+    return get_threshold_rules(location).thresholds
+
+# Recent in-process history of a fetched signal; timestamps are epoch milliseconds.
+@app.get("/telemetry/recent")
+def telemetry_recent(location: str = Query("London"), signal: str = Query("sensors.tank_fill_percent"), n: int = Query(60, ge=1)):
+    return recent_telemetry(location, signal, n)
+
+# Persisted history of a signal (including 'risk.level'); start/end are epoch milliseconds.
+@app.get("/telemetry/history")
+def telemetry_history_query(location: str = Query("London"), signal: str = Query("sensors.tank_fill_percent"),
+                            start: Optional[int] = Query(None), end: Optional[int] = Query(None), limit: Optional[int] = Query(1000, ge=1)):
+    return telemetry_history_range(location, signal, start, end, limit)
+
+# Returns the rule-based decision and actuation outcome at once; the GPT advisory
+# follows via /overflow/advisory/{job_id} (pass wait=N to long-poll for it).
+@app.get("/overflow")
+async def overflow(location: str = Query("London"), defer_advisory: bool = Query(True)):
+    return await overflow_control_async(location, defer_advisory=defer_advisory)
+
+@app.get("/overflow/advisory/{job_id}")
+async def overflow_advisory(job_id: str, wait: float = Query(0, ge=0, le=60)):
+    job = await get_advisory_job_async(job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired advisory job")
+    return job
+
+@app.get("/analyse")
+async def analyse(location: str = Query("London")):
+    return await run_all_analyses_async(location)
+
+@app.get("/advisory")
+async def advisory(location: str = Query("London")):
+    return await generate_contextual_advisory_async(location)
+
+@app.get("/advisory/stream")
+async def advisory_stream(location: str = Query("London")):
+    return sse_response(stream_contextual_advisory_async(location))
+
+@app.get("/forecast")
+async def forecast(location: str = Query("London"), horizon_days: int = Query(3)):
+    return await run_in_threadpool(forecast_weather_with_gpt, location, horizon_days)
+
+@app.get("/forecast/stream")
+async def forecast_stream(location: str = Query("London"), horizon_days: int = Query(3)):
+    return sse_response(stream_weather_forecast_async(location, horizon_days))
+
+# ✅ FIXED: POST + JSON body
+# Storm runs are queued as background jobs; poll GET /storm/{job_id} for stage progress.
+@app.post("/storm", status_code=202)
+async def storm(req: StormRequest):
+    try:
+        job_id = submit_storm_job(req.location)
+    except StormQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return await get_storm_job_async(job_id)
+
+# Regional runs: one SSE event per location as it completes, then 'done'.
+@app.post("/batch/analyse")
+async def batch_analyse(req: BatchRequest):
+    return sse_response(iterate_in_threadpool(run_batch('analyses', req.locations, req.concurrency)))
+
+@app.post("/batch/storm")
+async def batch_storm(req: BatchRequest):
+    return sse_response(iterate_in_threadpool(run_batch('storm', req.locations, req.concurrency)))
+
+@app.get("/storm/leases")
+def storm_lease_list():
+    return storm_leases.active()
+
+@app.get("/storm/{job_id}")
+async def storm_status(job_id: str, wait: float = Query(0, ge=0, le=60)):
+    job = await get_storm_job_async(job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired storm job")
+    return job
@@ -5,6 +5,7 @@ from Water_llm_COMPLETE import (
     storm_response_coordinator,
     forecast_weather_with_gpt
 )
+from sse_client import stream_advisory, stream_forecast, SSEStreamError
 
 st.set_page_config(page_title="💧 Water LLM Dashboard", layout="wide")
 
@@ -14,7 +15,7 @@ st.title("💧 Water LLM Monitoring & Forecasting")
 location = st.selectbox("🌍 Select Monitoring Location", ["London", "Manchester", "Birmingham", "Leeds"])
 
 st.markdown("---")
-tab1, tab2, tab3 = st.tabs(["📊 Real-Time Analysis", "⛈️ Storm Response", "📡 Forecast Advisory"])
+tab1, tab2, tab3, tab4 = st.tabs(["📊 Real-Time Analysis", "⛈️ Storm Response", "📡 Forecast Advisory", "🧠 Contextual Advisory"])
 
 with tab1:
     st.header("📊 Real-Time Water System Analysis")
@@ -84,7 +85,26 @@ with tab3:
     st.header("📡 GPT-Based Weather & Overflow Forecast")
     horizon = st.slider("📅 Forecast Days", min_value=1, max_value=5, value=3)
     if st.button("📈 Generate Forecast"):
-        with st.spinner("Fetching GenAI forecast..."):
-            forecast = forecast_weather_with_gpt(location, horizon_days=horizon)
-        st.success("✅ Forecast complete")
-        st.markdown(forecast)
+        try:
+            st.write_stream(stream_forecast(location, horizon_days=horizon))
+            st.success("✅ Forecast complete")
+        except SSEStreamError as e:
+            st.error(f"❌ Forecast stream was cut off; the text above is incomplete: {e}")
+        except Exception:
+            # API not reachable: fall back to the blocking engine call.
+            with st.spinner("Fetching GenAI forecast..."):
+                forecast = forecast_weather_with_gpt(location, horizon_days=horizon)
+            st.markdown(forecast)
+            st.success("✅ Forecast complete")
+
+with tab4:
+    st.header("🧠 Live Contextual Advisory")
+    st.caption("Streamed from the Water LLM API as the advisory is generated.")
+    if st.button("🧠 Generate Advisory"):
+        try:
+            st.write_stream(stream_advisory(location))
+            st.success("✅ Advisory complete")
+        except SSEStreamError as e:
+            st.error(f"❌ Advisory stream was cut off; the text above is incomplete: {e}")
+        except Exception as e:
+            st.error(f"❌ Could not reach the advisory stream: {e}")
@@ -0,0 +1,190 @@
+# mock_openai_server.py
+"""
+Offline stand-in for the OpenAI chat-completions API, for load-testing the
+LLM-bound paths of the Water LLM engines without network access.
+
+Answers are deterministic: each prompt family the engines send gets a templated
+reply, and anything else gets a canned reply derived from the prompt text.
+Latency, streaming token rate and error rate are configurable.
+
+    python mock_openai_server.py --port 8001 --latency lognormal:0.0,0.4 --tokens-per-second 40 --error-rate 0.01
+    export OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=offline
+
+Latency specs: fixed:S | uniform:LO,HI | normal:MEAN,SD | lognormal:MU,SIGMA (seconds).
+Extra rules can be supplied with --responses rules.json, a list of
+{"pattern": <regex on the user prompt>, "response": <template using named groups>}.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+COMBINED_FIELDS = ['overflow_prediction', 'control_advisory', 'anomaly_detection', 'compliance_check']
+
+DEFAULT_RULES = [
+    (r'JSON schema', None),
+    (r'What are the next steps for a (?P<risk>\w+) overflow scenario at (?P<location>[^?]+)\?',
+     '1. Confirm {risk} overflow risk at {location} against live telemetry.\n'
+     '2. Adjust pumps and valves per the {risk} playbook and notify the duty operator.\n'
+     '3. Log the intervention for regulatory reporting.'),
+    (r'assess the situation for (?P<location>[^:]+):\n- Rainfall: (?P<rain>[^m]*)mm\n- Tank Fill: (?P<fill>[^%]*)%',
+     'Situation at {location}: rainfall {rain}mm, tank fill {fill}%.\n'
+     'Mitigation: pre-emptively lower storage levels and stage buffer pumps.\n'
+     'Operator actions: monitor high-risk zones and confirm valve positions.\n'
+     'Compliance: record all discharges and notify the Environment Agency if a spill occurs.'),
+    (r'raining heavily in (?P<location>.+?), \npredict the likely weather trend for the next (?P<days>\d+) days',
+     'Expect continued heavy rain over {location} for the next {days} days, easing towards the end of the period.\n'
+     'Overflow risk remains elevated; keep storm tanks drawn down and pumps on standby.'),
+    (r'Predict if an overflow is likely', 'Overflow is unlikely in the next 12 hours at current inflow; no rerouting needed.'),
+    (r'Recommend immediate control actions', 'Hold pump speed, keep Valve A partially open and route excess to the storm tank.'),
+    (r'performing anomaly detection', 'No critical equipment failure indicated; schedule a routine vibration inspection.'),
+    (r'evaluating regulatory compliance', 'No compliance breach identified; continue monitoring discharge treatment.'),
+    (r'suggest an appropriate recommended action', 'Lower the tank level and increase monitoring frequency.'),
+]
+
+
+def parse_latency(spec):
+    """Turn a latency spec into a sampler taking a random.Random."""
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',')] if args else []
+    if kind == 'fixed':
+        return lambda rng: values[0]
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f'Unknown latency spec: {spec}')
+
+
+class StandInConfig:
+    """Behaviour knobs for the stand-in, read from env and overridable on the command line."""
+
+    def __init__(self):
+        self.latency = os.getenv('MOCK_OPENAI_LATENCY', 'fixed:0.5')
+        self.tokens_per_second = float(os.getenv('MOCK_OPENAI_TOKENS_PER_SECOND', '50'))
+        self.error_rate = float(os.getenv('MOCK_OPENAI_ERROR_RATE', '0'))
+        self.error_status = int(os.getenv('MOCK_OPENAI_ERROR_STATUS', '500'))
+        self.seed = int(os.getenv('MOCK_OPENAI_SEED', '42'))
+        self.rules_file = os.getenv('MOCK_OPENAI_RESPONSES', '')
+        self.apply()
+
+    def apply(self):
+        self.sample_latency = parse_latency(self.latency)
+        self.rng = random.Random(self.seed)
+        rules = []
+        if self.rules_file:
+            with open(self.rules_file, encoding='utf-8') as f:
+                rules = [(rule['pattern'], rule['response']) for rule in json.load(f)]
+        self.rules = [(re.compile(pattern), template) for pattern, template in rules + DEFAULT_RULES]
+
+
+config = StandInConfig()
+stats = {'requests': 0, 'errors_injected': 0, 'streamed': 0}
+app = FastAPI(title='Offline OpenAI stand-in')
+
+
+def answer_for(prompt):
+    """Deterministic reply for a user prompt."""
+    for pattern, template in config.rules:
+        match = pattern.search(prompt)
+        if not match:
+            continue
+        if template is None:
+            return json.dumps({field: f'Stand-in {field.replace("_", " ")}: no breach, no action required.' for field in COMBINED_FIELDS})
+        return template.format(**{k: (v or '').strip() for k, v in match.groupdict().items()})
+    digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]
+    return f'Stand-in response {digest}: conditions reviewed, maintain current configuration.'
+
+
+def tokenize(text):
+    """Split text into word-ish tokens that rejoin to the original."""
+    return re.findall(r'\S+\s*|\s+', text)
+
+
+def _completion_id():
+    return f'chatcmpl-{uuid.uuid4().hex[:24]}'
+
+
+@app.get('/v1/models')
+async def models():
+    return {'object': 'list', 'data': [{'id': 'gpt-4', 'object': 'model', 'owned_by': 'stand-in'}]}
+
+
+@app.get('/stats')
+async def get_stats():
+    return stats
+
+
+@app.post('/v1/chat/completions')
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats['requests'] += 1
+    model = body.get('model', 'gpt-4')
+    prompt = next((m.get('content', '') for m in reversed(body.get('messages', [])) if m.get('role') == 'user'), '')
+    prompt_tokens = sum(len(tokenize(m.get('content', ''))) for m in body.get('messages', []))
+    await asyncio.sleep(config.sample_latency(config.rng))
+    if config.rng.random() < config.error_rate:
+        stats['errors_injected'] += 1
+        return JSONResponse(status_code=config.error_status, content={'error': {'message': 'Injected stand-in failure', 'type': 'server_error'}})
+
+    text = answer_for(prompt)
+    tokens = tokenize(text)
+    created = int(time.time())
+    completion_id = _completion_id()
+    if not body.get('stream'):
+        await asyncio.sleep(len(tokens) / config.tokens_per_second if config.tokens_per_second > 0 else 0)
+        return {
+            'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens), 'total_tokens': prompt_tokens + len(tokens)},
+        }
+
+    stats['streamed'] += 1
+    delay = 1 / config.tokens_per_second if config.tokens_per_second > 0 else 0
+
+    def chunk(delta, finish_reason=None):
+        payload = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                   'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+        return f'data: {json.dumps(payload)}\n\n'
+
+    async def events():
+        yield chunk({'role': 'assistant', 'content': ''})
+        for token in tokens:
+            if delay:
+                await asyncio.sleep(delay)
+            yield chunk({'content': token})
+        yield chunk({}, 'stop')
+        yield 'data: [DONE]\n\n'
+
+    return StreamingResponse(events(), media_type='text/event-stream')
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='Offline OpenAI chat-completions stand-in.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', default=config.latency, help='fixed:S | uniform:LO,HI | normal:MEAN,SD | lognormal:MU,SIGMA')
+    parser.add_argument('--tokens-per-second', type=float, default=config.tokens_per_second)
+    parser.add_argument('--error-rate', type=float, default=config.error_rate)
+    parser.add_argument('--error-status', type=int, default=config.error_status)
+    parser.add_argument('--seed', type=int, default=config.seed)
+    parser.add_argument('--responses', default=config.rules_file, help='JSON file of extra {pattern, response} rules')
+    args = parser.parse_args()
+    config.latency, config.tokens_per_second = args.latency, args.tokens_per_second
+    config.error_rate, config.error_status = args.error_rate, args.error_status
+    config.seed, config.rules_file = args.seed, args.responses
+    config.apply()
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
@@ -0,0 +1,339 @@
+# protocol_sessions.py
+"""
+Long-lived OPC-UA, Modbus and MQTT sessions shared by the Water LLM engine.
+
+Sessions are keyed by endpoint (taken from integration_config), connect lazily on
+first use, are kept warm between commands and reconnect after a failed write.
+Run this module directly to exercise a local PLC simulator, OPC-UA server or broker:
+
+    python protocol_sessions.py --modbus 127.0.0.1:5020 --opcua opc.tcp://127.0.0.1:4840 --mqtt localhost
+
+or, with pymodbus installed, to check a Modbus write/read round trip (including a
+reconnect after the session is dropped) against a server it starts itself:
+
+    python protocol_sessions.py --local-modbus
+"""
+
+import importlib.util
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+
+logger = logging.getLogger('WaterLLM')
+
+CONNECT_TIMEOUT = 5
+PUBLISH_TIMEOUT = 5
+MQTT_KEEPALIVE = 60
+LIVENESS_INTERVAL = 30
+OPCUA_COMMAND_PATH = ['0:MyDevice', '0:Command']
+MODBUS_COMMAND_REGISTER = 1
+
+
+@lru_cache(maxsize=None)
+def protocol_available(module):
+    """Whether an optional protocol library is installed, without importing it."""
+    return importlib.util.find_spec(module) is not None
+
+
+class _Session(ABC):
+    """One warm connection to a field endpoint, serialised by its own lock."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.client = None
+        self.lock = threading.Lock()
+        self.last_ok = 0.0
+
+    @abstractmethod
+    def _connect(self):
+        """Open and return a new client for the endpoint."""
+
+    @abstractmethod
+    def _disconnect(self, client):
+        """Close a client returned by _connect."""
+
+    def _ping(self, client):
+        return True
+
+    def ensure_connected(self):
+        """Connect if there is no session yet; must be called with the lock held."""
+        if self.client is None:
+            self.client = self._connect()
+            self.last_ok = time.monotonic()
+            logger.info(f'🔌 Opened session to {self.endpoint}')
+        return self.client
+
+    def invalidate(self):
+        """Drop the current connection so the next call reconnects."""
+        client, self.client = self.client, None
+        if client is not None:
+            try:
+                self._disconnect(client)
+            except Exception as e:
+                logger.warning(f'⚠️ Error closing session to {self.endpoint}: {e}')
+
+    def is_alive(self):
+        """Liveness check; cheap when the session was used recently."""
+        with self.lock:
+            if self.client is None:
+                return False
+            if time.monotonic() - self.last_ok < LIVENESS_INTERVAL:
+                return True
+            try:
+                alive = self._ping(self.client)
+            except Exception:
+                alive = False
+            if alive:
+                self.last_ok = time.monotonic()
+            else:
+                self.invalidate()
+            return alive
+
+    def run(self, operation):
+        """Run operation(client) on the warm session, reconnecting once if it fails."""
+        with self.lock:
+            for attempt in (1, 2):
+                client = self.ensure_connected()
+                try:
+                    result = operation(client)
+                    self.last_ok = time.monotonic()
+                    return result
+                except Exception:
+                    self.invalidate()
+                    if attempt == 2:
+                        raise
+                    logger.warning(f'⚠️ Session to {self.endpoint} failed, reconnecting')
+
+    def close(self):
+        with self.lock:
+            self.invalidate()
+
+
+class MqttSession(_Session):
+    """Persistent MQTT client with a background network loop."""
+
+    def __init__(self, broker, port=1883):
+        super().__init__(f'mqtt://{broker}:{port}')
+        self.broker = broker
+        self.port = port
+
+    def _connect(self):
+        import paho.mqtt.client as mqtt_client
+        try:
+            client = mqtt_client.Client(mqtt_client.CallbackAPIVersion.VERSION2)
+        except AttributeError:
+            client = mqtt_client.Client()
+        client.connect(self.broker, self.port, keepalive=MQTT_KEEPALIVE)
+        client.loop_start()
+        return client
+
+    def _disconnect(self, client):
+        client.disconnect()
+        client.loop_stop()
+
+    def _ping(self, client):
+        return client.is_connected()
+
+    def publish(self, topic, payload):
+        def _publish(client):
+            info = client.publish(topic, payload=payload, qos=1)
+            info.wait_for_publish(timeout=PUBLISH_TIMEOUT)
+            if not info.is_published():
+                raise TimeoutError(f'MQTT publish to {topic} not acknowledged within {PUBLISH_TIMEOUT}s')
+        self.run(_publish)
+
+
+class OpcUaSession(_Session):
+    """Persistent OPC-UA client with the command node resolved once per connection."""
+
+    def __init__(self, url):
+        super().__init__(url)
+        self.url = url
+        self.command_node = None
+
+    def _connect(self):
+        from opcua import Client
+        client = Client(self.url, timeout=CONNECT_TIMEOUT)
+        client.connect()
+        self.command_node = client.get_objects_node().get_child(OPCUA_COMMAND_PATH)
+        return client
+
+    def _disconnect(self, client):
+        self.command_node = None
+        client.disconnect()
+
+    def _ping(self, client):
+        # Server_ServerStatus_State
+        client.get_node('i=2259').get_value()
+        return True
+
+    def write_command(self, command):
+        self.run(lambda client: self.command_node.set_value(command))
+
+
+class ModbusSession(_Session):
+    """Persistent Modbus/TCP client."""
+
+    def __init__(self, ip, port):
+        super().__init__(f'modbus://{ip}:{port}')
+        self.ip = ip
+        self.port = int(port)
+
+    def _connect(self):
+        from pymodbus.client import ModbusTcpClient
+        client = ModbusTcpClient(self.ip, port=self.port, timeout=CONNECT_TIMEOUT)
+        if not client.connect():
+            raise ConnectionError(f'Could not connect to PLC at {self.ip}:{self.port}')
+        return client
+
+    def _disconnect(self, client):
+        client.close()
+
+    def _ping(self, client):
+        return client.connected
+
+    def write_register(self, address, value):
+        def _write(client):
+            response = client.write_register(address, value)
+            if response.isError():
+                raise IOError(f'Modbus write to register {address} failed: {response}')
+        self.run(_write)
+
+    def read_register(self, address):
+        def _read(client):
+            response = client.read_holding_registers(address, count=1)
+            if response.isError():
+                raise IOError(f'Modbus read of register {address} failed: {response}')
+            return response.registers[0]
+        return self.run(_read)
+
+
+class ProtocolSessionPool:
+    """Process-wide registry of field sessions keyed by endpoint."""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key, factory):
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = factory()
+            return session
+
+    def mqtt(self, broker, port=1883):
+        return self._get(('mqtt', broker, int(port)), lambda: MqttSession(broker, int(port)))
+
+    def opcua(self, url):
+        return self._get(('opcua', url), lambda: OpcUaSession(url))
+
+    def modbus(self, ip, port):
+        return self._get(('modbus', ip, int(port)), lambda: ModbusSession(ip, port))
+
+    def status(self):
+        """Liveness of every known session, keyed by endpoint."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {session.endpoint: session.is_alive() for session in sessions}
+
+    def close_all(self):
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            session.close()
+
+
+protocol_pool = ProtocolSessionPool()
+
+
+def _start_local_modbus_server():
+    """Serve holding registers on a free localhost port from a background thread; returns the port."""
+    import asyncio
+    import socket
+    from pymodbus.datastore import ModbusSequentialDataBlock, ModbusServerContext
+    from pymodbus.server import StartAsyncTcpServer
+    try:
+        from pymodbus.datastore import ModbusDeviceContext
+        context = ModbusServerContext(devices=ModbusDeviceContext(hr=ModbusSequentialDataBlock(1, [0] * 100)), single=True)
+    except ImportError:
+        from pymodbus.datastore import ModbusSlaveContext
+        context = ModbusServerContext(slaves=ModbusSlaveContext(hr=ModbusSequentialDataBlock(1, [0] * 100)), single=True)
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    threading.Thread(target=lambda: asyncio.run(StartAsyncTcpServer(context=context, address=('127.0.0.1', port))),
+                     name='local-modbus', daemon=True).start()
+    deadline = time.monotonic() + CONNECT_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return port
+        except OSError:
+            time.sleep(0.05)
+    raise ConnectionError(f'Local Modbus server did not start on port {port}')
+
+
+def check_local_modbus(count=50):
+    """Write and read back registers through a pooled session against a local server; raises on a mismatch."""
+    port = _start_local_modbus_server()
+    pool = ProtocolSessionPool()
+    session = pool.modbus('127.0.0.1', port)
+    try:
+        for i in range(count):
+            session.write_register(MODBUS_COMMAND_REGISTER, i)
+            value = session.read_register(MODBUS_COMMAND_REGISTER)
+            if value != i:
+                raise AssertionError(f'Register {MODBUS_COMMAND_REGISTER} read back {value}, expected {i}')
+            if i == count // 2:
+                # A failed command must drop the connection and retry once on a fresh one.
+                before, failed = session.client, []
+
+                def _fail_once(client):
+                    if not failed:
+                        failed.append(client)
+                        raise ConnectionError('simulated link drop')
+                    return client
+                if session.run(_fail_once) is before:
+                    raise AssertionError(f'Session to {session.endpoint} did not reconnect after a failure')
+        if not session.is_alive():
+            raise AssertionError(f'Session to {session.endpoint} not alive after round trips')
+    finally:
+        pool.close_all()
+    return count
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description='Exercise pooled protocol sessions against local endpoints.')
+    parser.add_argument('--modbus', help='PLC endpoint as host:port')
+    parser.add_argument('--opcua', help='OPC-UA endpoint URL')
+    parser.add_argument('--mqtt', help='MQTT broker host')
+    parser.add_argument('--topic', default='water_llm/selftest')
+    parser.add_argument('--local-modbus', action='store_true', help='round-trip check against a local pymodbus server')
+    parser.add_argument('--count', type=int, default=100)
+    args = parser.parse_args()
+
+    if args.local_modbus:
+        print(f'✅ Modbus: {check_local_modbus(args.count)} write/read round trips matched')
+
+    checks = []
+    if args.modbus:
+        host, port = args.modbus.rsplit(':', 1)
+        checks.append(('Modbus', lambda i: protocol_pool.modbus(host, port).write_register(MODBUS_COMMAND_REGISTER, i % 65536)))
+    if args.opcua:
+        checks.append(('OPC-UA', lambda i: protocol_pool.opcua(args.opcua).write_command(f'selftest_{i}')))
+    if args.mqtt:
+        checks.append(('MQTT', lambda i: protocol_pool.mqtt(args.mqtt).publish(args.topic, f'selftest_{i}')))
+    for name, send in checks:
+        start = time.perf_counter()
+        for i in range(args.count):
+            send(i)
+        elapsed = time.perf_counter() - start
+        print(f'{name}: {args.count} commands in {elapsed:.3f}s ({elapsed / args.count * 1000:.2f} ms/command)')
+    print(protocol_pool.status())
+    protocol_pool.close_all()
@@ -0,0 +1,87 @@
+# risk_batch.py
+"""
+Vectorised forms of the Water LLM rule functions for bulk (site, time) rows.
+
+Each function takes array-likes and returns NumPy arrays that decode to exactly
+what the scalar functions in water_llm_engine_2 return row by row:
+
+    calculate_overflow_risk  -> overflow_risk_codes   (RISK_LEVELS[code])
+    predict_overflow         -> predict_overflow_batch (bool)
+    dynamic_control_advice   -> control_advice_codes  (CONTROL_ADVICE[code])
+    compliance_check         -> compliance_flags      (COMPLIANCE_MESSAGES[flag])
+
+Thresholds come from a compiled ThresholdRules (threshold_rules.py), the same
+object the scalar functions take, defaulting to DEFAULT_RULES. Inputs are
+compared as float64, as the scalar functions compare Python floats; NaN fails
+every threshold in both. benchmarks/bench_risk_engine.py checks parity and
+reports rows per second.
+"""
+
+import numpy as np
+
+from threshold_rules import (DEFAULT_RULES, ADVICE_MAINTAIN as _MAINTAIN, ADVICE_PUMP_SPEED as _PUMP_SPEED,
+                             ADVICE_BACKUP_PUMP as _BACKUP_PUMP, COMPLIANCE_BREACH, COMPLIANT)
+
+RISK_LEVELS = np.array(['LOW', 'MEDIUM', 'HIGH'], dtype=object)
+RISK_LOW, RISK_MEDIUM, RISK_HIGH = 0, 1, 2
+
+CONTROL_ADVICE = np.array([_MAINTAIN, _PUMP_SPEED, _BACKUP_PUMP], dtype=object)
+ADVICE_MAINTAIN, ADVICE_PUMP_SPEED, ADVICE_BACKUP_PUMP = 0, 1, 2
+
+# Indexed by the compliance flag: False (0) is a breach, True (1) compliant.
+COMPLIANCE_MESSAGES = np.array([COMPLIANCE_BREACH, COMPLIANT], dtype=object)
+
+
+def _as_float(values):
+    return np.asarray(values, dtype=np.float64)
+
+
+def overflow_risk_codes(rain_mm, tank_fill_percent, rules=DEFAULT_RULES):
+    """Risk level per row as int8 codes into RISK_LEVELS."""
+    rain, fill = np.broadcast_arrays(_as_float(rain_mm), _as_float(tank_fill_percent))
+    codes = np.zeros(rain.shape, dtype=np.int8)
+    codes[(rain > rules.risk_medium_rain_mm) & (fill > rules.risk_medium_tank_fill)] = RISK_MEDIUM
+    codes[(rain > rules.risk_high_rain_mm) & (fill > rules.risk_high_tank_fill)] = RISK_HIGH
+    return codes
+
+
+def predict_overflow_batch(rainfall_mm, tank_fill_percent, rules=DEFAULT_RULES):
+    """Overflow prediction per row as a bool array."""
+    return (_as_float(rainfall_mm) > rules.overflow_rain_mm) | (_as_float(tank_fill_percent) > rules.overflow_tank_fill)
+
+
+def control_advice_codes(tank_fill_percent, rules=DEFAULT_RULES):
+    """Control advice per row as int8 codes into CONTROL_ADVICE."""
+    fill = _as_float(tank_fill_percent)
+    codes = np.zeros(fill.shape, dtype=np.int8)
+    codes[fill > rules.advice_pump_speed_tank_fill] = ADVICE_PUMP_SPEED
+    codes[fill > rules.advice_backup_pump_tank_fill] = ADVICE_BACKUP_PUMP
+    return codes
+
+
+def compliance_flags(rainfall_mm, overflow_triggered, rules=DEFAULT_RULES):
+    """Compliance per row as a bool array; False marks a breach."""
+    return ~((_as_float(rainfall_mm) > rules.compliance_rain_mm) & ~np.asarray(overflow_triggered, dtype=bool))
+
+
+def evaluate(rainfall_mm, tank_fill_percent, rules=DEFAULT_RULES):
+    """All four rules over the same rows, as the storm assessment chains them."""
+    overflow = predict_overflow_batch(rainfall_mm, tank_fill_percent, rules)
+    return {
+        'risk': overflow_risk_codes(rainfall_mm, tank_fill_percent, rules),
+        'overflow': overflow,
+        'advice': control_advice_codes(tank_fill_percent, rules),
+        'compliant': compliance_flags(rainfall_mm, overflow, rules),
+    }
+
+
+def risk_labels(codes):
+    return RISK_LEVELS[codes]
+
+
+def advice_labels(codes):
+    return CONTROL_ADVICE[codes]
+
+
+def compliance_labels(flags):
+    return COMPLIANCE_MESSAGES[np.asarray(flags, dtype=np.int8)]
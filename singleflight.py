@@ -0,0 +1,94 @@
+# singleflight.py
+"""
+Request coalescing: concurrent callers asking for the same key share one
+execution of the underlying call. Waiters are released together when it
+finishes and all of them receive its result or its exception.
+"""
+
+import asyncio
+import threading
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Thread-based coalescing for blocking calls."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = {'executions': 0, 'coalesced': 0}
+
+    def do(self, key, fn):
+        """Run fn() once per key among concurrent callers and share its outcome."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._stats['executions'] += 1
+            else:
+                flight.waiters += 1
+                self._stats['coalesced'] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._flights))
+
+
+class AsyncSingleFlight:
+    """Coroutine coalescing: the shared call runs as its own task, so a waiter
+    being cancelled never cancels the work the other waiters depend on."""
+
+    def __init__(self):
+        self._tasks = {}
+        self._stats = {'executions': 0, 'coalesced': 0}
+
+    async def do(self, key, coro_fn):
+        """Await coro_fn() once per key among concurrent callers and share its outcome."""
+        loop_key = (id(asyncio.get_running_loop()), key)
+        task = self._tasks.get(loop_key)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn())
+            self._tasks[loop_key] = task
+            task.add_done_callback(lambda t: self._finished(loop_key, t))
+            self._stats['executions'] += 1
+        else:
+            self._stats['coalesced'] += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, loop_key, task):
+        self._tasks.pop(loop_key, None)
+        if not task.cancelled():
+            # Mark the exception retrieved even if every waiter was cancelled.
+            task.exception()
+
+    def stats(self):
+        return dict(self._stats, in_flight=len(self._tasks))
@@ -0,0 +1,51 @@
+# sse_client.py
+"""
+Minimal server-sent-events consumer for the Water LLM API streaming routes,
+for use with ``st.write_stream`` in the Streamlit dashboards.
+"""
+
+import json
+import os
+
+API_BASE_URL = os.getenv('WATER_LLM_API_URL', 'http://localhost:8000')
+
+
+class SSEStreamError(RuntimeError):
+    """Raised when a stream reports an error or ends without its 'done' event."""
+
+
+def iter_sse_text(path, params=None, base_url=API_BASE_URL, connect_timeout=5):
+    """Yield the text chunks of an SSE stream until its 'done' event.
+
+    Raises SSEStreamError if the server sends an 'error' event or the stream
+    closes early, so a cut-off answer is never mistaken for a complete one.
+    """
+    import requests
+    with requests.get(f'{base_url}{path}', params=params, stream=True, timeout=(connect_timeout, None),
+                      headers={'Accept': 'text/event-stream'}) as response:
+        response.raise_for_status()
+        event, data = 'message', []
+        for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+            if line:
+                field, _, value = line.partition(':')
+                if field == 'event':
+                    event = value.strip()
+                elif field == 'data':
+                    data.append(value[1:] if value.startswith(' ') else value)
+                continue
+            if event == 'done':
+                return
+            if event == 'error':
+                raise SSEStreamError(json.loads('\n'.join(data) or '{}').get('error', 'stream failed'))
+            if data:
+                yield json.loads('\n'.join(data))
+            event, data = 'message', []
+    raise SSEStreamError('stream ended before completion')
+
+
+def stream_advisory(location):
+    return iter_sse_text('/advisory/stream', {'location': location})
+
+
+def stream_forecast(location, horizon_days=3):
+    return iter_sse_text('/forecast/stream', {'location': location, 'horizon_days': horizon_days})
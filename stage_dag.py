@@ -0,0 +1,97 @@
+# stage_dag.py
+"""
+Dependency-graph executor for multi-stage runs such as the storm coordinator.
+
+Each stage names the stages whose results it consumes and receives them as
+keyword arguments. A stage is started as soon as all of its dependencies have
+finished, so independent stages overlap and a run takes as long as its longest
+dependency chain. Every stage has its own timeout; a stage that fails or times
+out causes the stages depending on it to be skipped, not the whole run.
+
+Stages listed in ``after`` only order a stage: it waits for them to end,
+however they end, and does not receive their results. A stage given an
+``on_timeout`` fallback hands that value to its dependents when it times out,
+so a slow upstream degrades the run rather than skipping the rest of it.
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+DONE, FAILED, TIMED_OUT, SKIPPED = 'done', 'failed', 'timed_out', 'skipped'
+
+
+class StageGraph:
+    """An ordered set of named stages and their dependencies."""
+
+    def __init__(self, default_timeout=None):
+        self.default_timeout = default_timeout
+        self._stages = {}
+
+    def add(self, name, fn, deps=(), timeout=None, after=(), on_timeout=None):
+        """Register fn(**{dep: result}) as a stage; deps and after must already be registered.
+
+        on_timeout, if given, is called to produce the stage's result when it times out.
+        """
+        missing = [dep for dep in (*deps, *after) if dep not in self._stages]
+        if missing:
+            raise ValueError(f'Stage {name} depends on unknown stages: {missing}')
+        if name in self._stages:
+            raise ValueError(f'Duplicate stage: {name}')
+        self._stages[name] = (fn, tuple(deps), tuple(after), timeout if timeout is not None else self.default_timeout,
+                              on_timeout)
+        return self
+
+    @property
+    def names(self):
+        return list(self._stages)
+
+    def run(self, executor, progress=None):
+        """Execute the graph on executor; returns (results, timings) keyed by stage name.
+
+        progress(stage, status) is called from the calling thread with
+        'running' when a stage starts and its final status when it ends.
+        """
+        progress = progress or (lambda stage, status: None)
+        results, timings = {}, {}
+        pending = dict(self._stages)
+        running = {}
+        while pending or running:
+            for name, (fn, deps, after, timeout, on_timeout) in list(pending.items()):
+                if any(dep in timings and dep not in results for dep in deps):
+                    del pending[name]
+                    timings[name] = {'status': SKIPPED, 'elapsed_s': 0.0,
+                                     'error': 'upstream stage did not complete'}
+                    progress(name, SKIPPED)
+                elif all(dep in results for dep in deps) and all(stage in timings for stage in after):
+                    del pending[name]
+                    started = time.monotonic()
+                    future = executor.submit(fn, **{dep: results[dep] for dep in deps})
+                    running[future] = (name, started, timeout, on_timeout)
+                    progress(name, 'running')
+            if not running:
+                continue
+            deadlines = [started + timeout for _, started, timeout, _ in running.values() if timeout is not None]
+            wait_for = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            finished, _ = wait(list(running), timeout=wait_for, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for future, (name, started, timeout, on_timeout) in list(running.items()):
+                if future in finished:
+                    entry = {'elapsed_s': round(now - started, 4)}
+                    try:
+                        results[name] = future.result()
+                        entry['status'] = DONE
+                    except Exception as e:
+                        entry.update(status=FAILED, error=str(e))
+                elif timeout is not None and now - started >= timeout:
+                    # The worker cannot be interrupted; it is abandoned and its result ignored.
+                    future.cancel()
+                    entry = {'status': TIMED_OUT, 'elapsed_s': round(now - started, 4),
+                             'error': f'no result within {timeout}s'}
+                    if on_timeout is not None:
+                        results[name] = on_timeout()
+                else:
+                    continue
+                del running[future]
+                timings[name] = entry
+                progress(name, entry['status'])
+        return results, timings
@@ -0,0 +1,84 @@
+# storm_leases.py
+"""
+Per-location storm leases shared by every worker process on the host.
+
+A storm run for a location holds a lease row in SQLite until it releases it or
+the TTL lapses. Acquisition is a single conditional upsert, so two workers
+racing for the same location cannot both win, while different locations never
+contend.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+STORM_LEASE_PATH = os.getenv('WATER_LLM_STORM_LEASE_PATH', 'logs/storm_leases.db')
+STORM_LEASE_TTL = float(os.getenv('WATER_LLM_STORM_LEASE_TTL', '900'))
+
+
+class StormLeaseRegistry:
+    """Location-keyed leases with TTL expiry, renewal and explicit release."""
+
+    def __init__(self, db_path=STORM_LEASE_PATH, ttl=STORM_LEASE_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS storm_leases (location TEXT PRIMARY KEY, holder TEXT, '
+                         'acquired_at REAL, expires_at REAL)')
+            self._conn = conn
+        return self._conn
+
+    def acquire(self, location, ttl=None):
+        """Take the lease for a location; returns a holder token, or None if it is held."""
+        holder = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}'
+        now = time.time()
+        expires_at = now + (ttl or self.ttl)
+        with self._lock:
+            cursor = self._db().execute(
+                'INSERT INTO storm_leases (location, holder, acquired_at, expires_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(location) DO UPDATE SET holder=excluded.holder, acquired_at=excluded.acquired_at, '
+                'expires_at=excluded.expires_at WHERE storm_leases.expires_at <= excluded.acquired_at',
+                (location, holder, now, expires_at))
+        return holder if cursor.rowcount == 1 else None
+
+    def renew(self, location, holder, ttl=None):
+        """Push a held lease's expiry out by another TTL; False if it was lost."""
+        expires_at = time.time() + (ttl or self.ttl)
+        with self._lock:
+            cursor = self._db().execute('UPDATE storm_leases SET expires_at=? WHERE location=? AND holder=?',
+                                        (expires_at, location, holder))
+        return cursor.rowcount == 1
+
+    def release(self, location, holder):
+        """Give the lease back; a lease since taken over by another holder is left alone."""
+        with self._lock:
+            cursor = self._db().execute('DELETE FROM storm_leases WHERE location=? AND holder=?', (location, holder))
+        return cursor.rowcount == 1
+
+    def active(self):
+        """Unexpired leases as dicts, oldest first."""
+        with self._lock:
+            rows = self._db().execute('SELECT location, holder, acquired_at, expires_at FROM storm_leases '
+                                      'WHERE expires_at > ? ORDER BY acquired_at', (time.time(),)).fetchall()
+        return [dict(zip(('location', 'holder', 'acquired_at', 'expires_at'), row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+storm_leases = StormLeaseRegistry()
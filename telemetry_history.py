@@ -0,0 +1,188 @@
+# telemetry_history.py
+"""
+Durable telemetry history in SQLite for post-event analysis and regulatory
+evidence.
+
+Request threads only enqueue points; a background writer drains the queue and
+commits them in batches (group commit) to a WAL-mode database indexed on
+(location, signal, ts). When the queue is full new points are dropped and
+counted rather than blocking the caller. Timestamps are epoch milliseconds.
+Queued points are flushed at interpreter exit.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('WaterLLM')
+
+TELEMETRY_HISTORY_ENABLED = os.getenv('WATER_LLM_TELEMETRY_HISTORY', '1') != '0'
+TELEMETRY_HISTORY_PATH = os.getenv('WATER_LLM_TELEMETRY_HISTORY_PATH', 'logs/telemetry_history.db')
+TELEMETRY_BATCH_SIZE = int(os.getenv('WATER_LLM_TELEMETRY_BATCH_SIZE', '1000'))
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv('WATER_LLM_TELEMETRY_FLUSH_INTERVAL', '0.5'))
+TELEMETRY_QUEUE_SIZE = int(os.getenv('WATER_LLM_TELEMETRY_QUEUE_SIZE', '100000'))
+TELEMETRY_RECONNECT_DELAY = 5
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS telemetry (location TEXT NOT NULL, signal TEXT NOT NULL, ts INTEGER NOT NULL, '
+    'value REAL, text TEXT)',
+    'CREATE INDEX IF NOT EXISTS idx_telemetry_location_signal_ts ON telemetry (location, signal, ts)',
+]
+
+
+class TelemetryHistory:
+    """Queue-fed, batch-committing writer plus range queries over the same file."""
+
+    def __init__(self, db_path=TELEMETRY_HISTORY_PATH, batch_size=TELEMETRY_BATCH_SIZE,
+                 flush_interval=TELEMETRY_FLUSH_INTERVAL, queue_size=TELEMETRY_QUEUE_SIZE, enabled=TELEMETRY_HISTORY_ENABLED):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._start_lock = threading.Lock()
+        self._read_conn = None
+        self._read_lock = threading.Lock()
+        self._stats = {'queued': 0, 'written': 0, 'dropped': 0, 'batches': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+
+    def _connect(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+        return conn
+
+    def _ensure_writer(self):
+        if self._writer is None:
+            with self._start_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._run, name='telemetry-history', daemon=True)
+                    self._writer.start()
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            for name, amount in increments.items():
+                self._stats[name] += amount
+
+    def record(self, location, signal, value=None, ts_ms=None, text=None):
+        """Enqueue one point; returns False if history is off or the queue is full."""
+        if not self.enabled:
+            return False
+        self._ensure_writer()
+        point = (location, signal, int(time.time() * 1000) if ts_ms is None else ts_ms, value, text)
+        try:
+            self._queue.put_nowait(point)
+        except queue.Full:
+            self._count(dropped=1)
+            return False
+        self._count(queued=1)
+        return True
+
+    def record_payload(self, location, payload, prefix='', ts_ms=None):
+        """Enqueue every numeric field of a sensor or weather payload under one timestamp."""
+        from telemetry_store import flatten_numeric
+        ts_ms = int(time.time() * 1000) if ts_ms is None else ts_ms
+        return sum(self.record(location, signal, value, ts_ms) for signal, value in flatten_numeric(payload, prefix))
+
+    def _run(self):
+        conn, retry_at = None, 0.0
+        while True:
+            batch, waiters = [], []
+            deadline = None
+            while len(batch) < self.batch_size:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if batch and conn is None and time.monotonic() >= retry_at:
+                try:
+                    conn = self._connect()
+                except (OSError, sqlite3.Error) as e:
+                    # Keep draining so producers never back up behind an unusable file; retry later.
+                    retry_at = time.monotonic() + TELEMETRY_RECONNECT_DELAY
+                    logger.error(f'❌ Cannot open telemetry history {self.db_path}: {e}')
+            if batch and conn is None:
+                self._count(errors=1, dropped=len(batch))
+            elif batch:
+                self._write(conn, batch)
+            for waiter in waiters:
+                waiter.set()
+
+    def _write(self, conn, batch):
+        try:
+            with conn:
+                conn.executemany('INSERT INTO telemetry (location, signal, ts, value, text) VALUES (?, ?, ?, ?, ?)', batch)
+            self._count(written=len(batch), batches=1)
+        except sqlite3.Error as e:
+            self._count(errors=1)
+            logger.error(f'❌ Failed to write {len(batch)} telemetry points: {e}')
+
+    def flush(self, timeout=10):
+        """Block until everything queued so far is committed."""
+        if self._writer is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _reader(self):
+        if self._read_conn is None:
+            self._read_conn = self._connect()
+        return self._read_conn
+
+    def query(self, location, signal, start_ms=None, end_ms=None, limit=None):
+        """Points for one signal in [start_ms, end_ms], oldest first, as dicts."""
+        sql = 'SELECT ts, value, text FROM telemetry WHERE location=? AND signal=?'
+        params = [location, signal]
+        if start_ms is not None:
+            sql += ' AND ts >= ?'
+            params.append(start_ms)
+        if end_ms is not None:
+            sql += ' AND ts <= ?'
+            params.append(end_ms)
+        sql += ' ORDER BY ts'
+        if limit is not None:
+            # Keep the newest `limit` points but still return them oldest first.
+            sql = f'SELECT * FROM ({sql} DESC LIMIT ?) ORDER BY ts'
+            params.append(limit)
+        with self._read_lock:
+            rows = self._reader().execute(sql, params).fetchall()
+        return [{'ts': ts, 'value': value, 'text': text} for ts, value, text in rows]
+
+    def signals(self, location):
+        with self._read_lock:
+            rows = self._reader().execute('SELECT DISTINCT signal FROM telemetry WHERE location=? ORDER BY signal', (location,)).fetchall()
+        return [row[0] for row in rows]
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats, pending=self._queue.qsize())
+
+    def close(self):
+        self.flush()
+        with self._read_lock:
+            if self._read_conn is not None:
+                self._read_conn.close()
+                self._read_conn = None
+
+
+telemetry_history = TelemetryHistory()
+atexit.register(telemetry_history.close)
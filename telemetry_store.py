@@ -0,0 +1,172 @@
+# telemetry_store.py
+"""
+In-process recent history for site telemetry: one fixed-capacity ring buffer
+per (location, signal), backed by preallocated NumPy arrays.
+
+Each ring stores int64 timestamps (ns since the epoch) and float64 values in
+arrays of twice its capacity, writing every sample at i and i + capacity. The
+most recent n samples are therefore always one contiguous slice, so windows
+are zero-copy views and an append is two array stores. Memory is fixed per
+signal (32 bytes x capacity) and the number of signals is capped.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger('WaterLLM')
+
+TELEMETRY_CAPACITY = int(os.getenv('WATER_LLM_TELEMETRY_CAPACITY', '1024'))
+TELEMETRY_MAX_SIGNALS = int(os.getenv('WATER_LLM_TELEMETRY_MAX_SIGNALS', '10000'))
+
+
+class SignalRing:
+    """Fixed-capacity time series for one signal. Timestamps must not go backwards."""
+
+    __slots__ = ('capacity', '_ts', '_values', '_head', '_count', '_lock', 'dropped')
+
+    def __init__(self, capacity=TELEMETRY_CAPACITY):
+        self.capacity = capacity
+        self._ts = np.zeros(2 * capacity, dtype=np.int64)
+        self._values = np.zeros(2 * capacity, dtype=np.float64)
+        self._head = 0
+        self._count = 0
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def append(self, value, ts_ns=None):
+        """Add one sample; a sample older than the newest one is dropped."""
+        ts_ns = time.time_ns() if ts_ns is None else ts_ns
+        with self._lock:
+            head = self._head
+            if self._count and ts_ns < self._ts[head + self.capacity - 1]:
+                self.dropped += 1
+                return False
+            self._ts[head] = self._ts[head + self.capacity] = ts_ns
+            self._values[head] = self._values[head + self.capacity] = value
+            self._head = (head + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+            return True
+
+    def __len__(self):
+        return self._count
+
+    def _bounds(self, n):
+        n = self._count if n is None else max(0, min(n, self._count))
+        end = self._head + self.capacity
+        return end - n, end
+
+    def window(self, n=None):
+        """The latest n samples (all if None) as (timestamps, values) views, oldest first.
+
+        The views alias the ring's storage: later appends overwrite them, so
+        copy them if they are kept beyond the current request.
+        """
+        with self._lock:
+            start, end = self._bounds(n)
+            return self._ts[start:end], self._values[start:end]
+
+    def since(self, ts_ns):
+        """Samples at or after ts_ns as (timestamps, values) views."""
+        with self._lock:
+            start, end = self._bounds(None)
+            offset = int(np.searchsorted(self._ts[start:end], ts_ns, side='left'))
+            return self._ts[start + offset:end], self._values[start + offset:end]
+
+    def latest(self):
+        """(timestamp, value) of the newest sample, or None if empty."""
+        with self._lock:
+            if not self._count:
+                return None
+            i = self._head + self.capacity - 1
+            return int(self._ts[i]), float(self._values[i])
+
+    @property
+    def nbytes(self):
+        return self._ts.nbytes + self._values.nbytes
+
+
+def flatten_numeric(payload, prefix=''):
+    """Yield (dotted name, float) for every numeric leaf of a JSON payload."""
+    if not isinstance(payload, dict):
+        return
+    for key, value in payload.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            yield from flatten_numeric(value, f'{name}.')
+        elif isinstance(value, (int, float)):
+            yield name, float(value)
+
+
+class TelemetryStore:
+    """Ring buffers keyed by (location, signal), created on first sample."""
+
+    def __init__(self, capacity=TELEMETRY_CAPACITY, max_signals=TELEMETRY_MAX_SIGNALS):
+        self.capacity = capacity
+        self.max_signals = max_signals
+        self._rings = {}
+        self._lock = threading.Lock()
+        self.rejected_signals = 0
+
+    def _ring(self, location, signal, create=False):
+        key = (location, signal)
+        ring = self._rings.get(key)
+        if ring is None and create:
+            with self._lock:
+                ring = self._rings.get(key)
+                if ring is None:
+                    if len(self._rings) >= self.max_signals:
+                        if not self.rejected_signals:
+                            logger.warning(f'⚠️ Telemetry store full at {self.max_signals} signals; new signals are not kept.')
+                        self.rejected_signals += 1
+                        return None
+                    ring = self._rings[key] = SignalRing(self.capacity)
+        return ring
+
+    def append(self, location, signal, value, ts_ns=None):
+        ring = self._ring(location, signal, create=True)
+        return ring.append(value, ts_ns) if ring is not None else False
+
+    def record(self, location, payload, prefix='', ts_ns=None):
+        """Append every numeric field of a sensor or weather payload under one timestamp."""
+        ts_ns = time.time_ns() if ts_ns is None else ts_ns
+        count = 0
+        for signal, value in flatten_numeric(payload, prefix):
+            count += bool(self.append(location, signal, value, ts_ns))
+        return count
+
+    def window(self, location, signal, n=None):
+        """Latest n samples of a signal as (timestamps, values) views; empty if unknown."""
+        ring = self._ring(location, signal)
+        if ring is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        return ring.window(n)
+
+    def since(self, location, signal, ts_ns):
+        ring = self._ring(location, signal)
+        if ring is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        return ring.since(ts_ns)
+
+    def latest(self, location, signal):
+        ring = self._ring(location, signal)
+        return ring.latest() if ring is not None else None
+
+    def signals(self, location=None):
+        """Known (location, signal) keys, optionally for one location."""
+        with self._lock:
+            keys = list(self._rings)
+        return [key for key in keys if location is None or key[0] == location]
+
+    def stats(self):
+        with self._lock:
+            rings = list(self._rings.values())
+        return {'signals': len(rings), 'capacity': self.capacity, 'max_signals': self.max_signals,
+                'samples': sum(len(ring) for ring in rings), 'dropped_out_of_order': sum(ring.dropped for ring in rings),
+                'rejected_signals': self.rejected_signals, 'bytes': sum(ring.nbytes for ring in rings)}
+
+
+telemetry = TelemetryStore()
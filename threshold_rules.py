@@ -0,0 +1,221 @@
+# threshold_rules.py
+"""
+Per-location threshold rules for the Water LLM rule functions.
+
+Rules are a JSON object of named thresholds, stored one row per location in the
+``threshold_rules`` table of integration.db next to integration_config. A row
+for location ``*`` overrides the defaults for every site, and a location's own
+row overrides that; any threshold left out keeps its inherited value:
+
+    {"risk_high_rain_mm": 25, "risk_high_tank_fill": 88}
+
+Each distinct rule set is validated and compiled once into a ThresholdRules
+object, whose methods are the scalar rules and whose attributes feed the
+vectorised rules in risk_batch. Edits are picked up without a restart, e.g.
+
+    python threshold_rules.py set Manchester '{"overflow_rain_mm": 70}'
+    python threshold_rules.py show Manchester
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from config_store import IntegrationConfigCache, CONFIG_REFRESH_INTERVAL
+
+logger = logging.getLogger('WaterLLM')
+
+RULES_TABLE = 'threshold_rules'
+GLOBAL_RULES_LOCATION = '*'
+
+# The comparisons are fixed (strictly above, or below for inflow); the values are tunable.
+DEFAULT_THRESHOLDS = {
+    'risk_high_rain_mm': 20,
+    'risk_high_tank_fill': 90,
+    'risk_medium_rain_mm': 10,
+    'risk_medium_tank_fill': 75,
+    'overflow_rain_mm': 80,
+    'overflow_tank_fill': 90,
+    'advice_backup_pump_tank_fill': 90,
+    'advice_pump_speed_tank_fill': 75,
+    'anomaly_overfill_tank_fill': 100,
+    'anomaly_min_inflow_lps': 0,
+    'compliance_rain_mm': 80,
+}
+
+ADVICE_MAINTAIN = 'Maintain current configuration.'
+ADVICE_PUMP_SPEED = 'Increase pump speed by 15%.'
+ADVICE_BACKUP_PUMP = 'Open secondary valve and enable backup pump.'
+ANOMALY_OVERFILL = 'Tank overfill detected.'
+ANOMALY_NEGATIVE_INFLOW = 'Negative inflow rate.'
+COMPLIANCE_BREACH = '⚠️ Non-compliance: Risk threshold breached with no response.'
+COMPLIANT = '✅ System compliant.'
+
+
+class InvalidRules(ValueError):
+    """Raised when a rule definition has unknown names or non-numeric values."""
+
+
+class ThresholdRules:
+    """One compiled rule set; the scalar rule functions as methods."""
+
+    __slots__ = tuple(DEFAULT_THRESHOLDS) + ('thresholds',)
+
+    def __init__(self, thresholds):
+        self.thresholds = dict(thresholds)
+        for name, value in self.thresholds.items():
+            setattr(self, name, value)
+
+    def overflow_risk(self, rain_mm, tank_fill_percent):
+        if rain_mm > self.risk_high_rain_mm and tank_fill_percent > self.risk_high_tank_fill:
+            return 'HIGH'
+        elif rain_mm > self.risk_medium_rain_mm and tank_fill_percent > self.risk_medium_tank_fill:
+            return 'MEDIUM'
+        return 'LOW'
+
+    def predict_overflow(self, rainfall_mm, tank_fill_percent):
+        return rainfall_mm > self.overflow_rain_mm or tank_fill_percent > self.overflow_tank_fill
+
+    def control_advice(self, tank_fill_percent):
+        if tank_fill_percent > self.advice_backup_pump_tank_fill:
+            return ADVICE_BACKUP_PUMP
+        elif tank_fill_percent > self.advice_pump_speed_tank_fill:
+            return ADVICE_PUMP_SPEED
+        return ADVICE_MAINTAIN
+
+    def anomalies(self, sensor_data):
+        anomalies = []
+        if sensor_data.get('tank_fill_percent', 0) > self.anomaly_overfill_tank_fill:
+            anomalies.append(ANOMALY_OVERFILL)
+        if sensor_data.get('inflow_rate_lps', -1) < self.anomaly_min_inflow_lps:
+            anomalies.append(ANOMALY_NEGATIVE_INFLOW)
+        return anomalies
+
+    def compliance(self, rainfall_mm, overflow_triggered):
+        if rainfall_mm > self.compliance_rain_mm and (not overflow_triggered):
+            return COMPLIANCE_BREACH
+        return COMPLIANT
+
+    def __repr__(self):
+        overrides = {k: v for k, v in self.thresholds.items() if DEFAULT_THRESHOLDS[k] != v}
+        return f'ThresholdRules({overrides})'
+
+
+def parse_rules(definition):
+    """Validate a rule definition (JSON text or dict) into a dict of thresholds."""
+    if definition is None or definition == '':
+        return {}
+    rules = json.loads(definition) if isinstance(definition, str) else definition
+    if not isinstance(rules, dict):
+        raise InvalidRules('Rules must be a JSON object of threshold names to numbers')
+    unknown = sorted(set(rules) - set(DEFAULT_THRESHOLDS))
+    if unknown:
+        raise InvalidRules(f'Unknown thresholds: {unknown}')
+    bad = sorted(name for name, value in rules.items() if isinstance(value, bool) or not isinstance(value, (int, float)))
+    if bad:
+        raise InvalidRules(f'Thresholds must be numbers: {bad}')
+    return rules
+
+
+def compile_rules(*definitions):
+    """Compile defaults overlaid with each definition in turn."""
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for definition in definitions:
+        thresholds.update(parse_rules(definition))
+    return ThresholdRules(thresholds)
+
+
+DEFAULT_RULES = compile_rules()
+
+
+class ThresholdRuleRegistry:
+    """Compiled rules per location, following edits to the threshold_rules table.
+
+    Rows are re-read through IntegrationConfigCache's change detection, and a
+    rule set is compiled only the first time its (global, location) text is seen.
+    A definition that fails validation is logged and that layer is ignored.
+    """
+
+    def __init__(self, db_path, refresh_interval=CONFIG_REFRESH_INTERVAL):
+        self.rows = IntegrationConfigCache(db_path, refresh_interval, table=RULES_TABLE)
+        self._lock = threading.Lock()
+        self._compiled = {}
+
+    def _layer(self, location, text):
+        try:
+            parse_rules(text)
+            return text
+        except (ValueError, TypeError) as e:
+            logger.error(f'❌ Ignoring invalid threshold rules for {location}: {e}')
+            return None
+
+    def get(self, location):
+        """Compiled rules for a location."""
+        global_text = self.rows.get(GLOBAL_RULES_LOCATION).get('rules')
+        location_text = self.rows.get(location).get('rules') if location != GLOBAL_RULES_LOCATION else None
+        key = (global_text, location_text)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            with self._lock:
+                compiled = self._compiled.get(key)
+                if compiled is None:
+                    compiled = compile_rules(self._layer(GLOBAL_RULES_LOCATION, global_text),
+                                             self._layer(location, location_text))
+                    self._compiled[key] = compiled
+        return compiled
+
+
+def _ensure_table(conn):
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {RULES_TABLE} (location TEXT PRIMARY KEY, rules TEXT NOT NULL, updated_at REAL)')
+
+
+def save_rules(db_path, location, definition):
+    """Validate and store a location's rules (location '*' for every site)."""
+    rules = parse_rules(definition)
+    conn = sqlite3.connect(db_path)
+    try:
+        _ensure_table(conn)
+        conn.execute(f'INSERT OR REPLACE INTO {RULES_TABLE} (location, rules, updated_at) VALUES (?, ?, ?)',
+                     (location, json.dumps(rules, sort_keys=True), time.time()))
+        conn.commit()
+    finally:
+        conn.close()
+    return rules
+
+
+def delete_rules(db_path, location):
+    conn = sqlite3.connect(db_path)
+    try:
+        _ensure_table(conn)
+        conn.execute(f'DELETE FROM {RULES_TABLE} WHERE location=?', (location,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage per-location threshold rules.')
+    parser.add_argument('--db', default='integration.db')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('defaults')
+    show = sub.add_parser('show')
+    show.add_argument('location')
+    set_cmd = sub.add_parser('set')
+    set_cmd.add_argument('location')
+    set_cmd.add_argument('rules', help='JSON object of threshold overrides')
+    delete = sub.add_parser('delete')
+    delete.add_argument('location')
+    args = parser.parse_args()
+
+    if args.command == 'defaults':
+        print(json.dumps(DEFAULT_THRESHOLDS, indent=2))
+    elif args.command == 'show':
+        print(json.dumps(ThresholdRuleRegistry(args.db).get(args.location).thresholds, indent=2))
+    elif args.command == 'set':
+        print(f'✅ Saved rules for {args.location}: {save_rules(args.db, args.location, args.rules)}')
+    elif args.command == 'delete':
+        delete_rules(args.db, args.location)
+        print(f'✅ Removed rules for {args.location}')
@@ -2,33 +2,55 @@
 
 import os
 import json
+import time
 import random
-import requests
 import datetime
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
+from llm_cache import llm_cache, cache_key, flight_key
+from singleflight import SingleFlight
+from log_index import LogIndex
+from log_aggregates import LogAggregates, UPGRADE_ZONES, breach_record, upgrade_zones
+from log_writer import log_writer
 
 # Load environment variables
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+_client = None
 
 LOG_FILE = "logs/water_llm_log.json"
 os.makedirs("logs", exist_ok=True)
 
-def call_gpt(prompt, temperature=0.3):
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": "You are a water infrastructure expert and regulatory advisor."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=temperature
-    )
-    return response.choices[0].message.content.strip()
+def get_client():
+    """Build the OpenAI client on first use so importing the engine stays cheap."""
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        # OPENAI_BASE_URL can point at an OpenAI-compatible stand-in such as mock_openai_server.py.
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL") or None)
+    return _client
+
+GPT_MODEL = "gpt-4"
+GPT_SYSTEM_PROMPT = "You are a water infrastructure expert and regulatory advisor."
+gpt_flights = SingleFlight()
+
+def call_gpt(prompt, temperature=0.3, family="default"):
+    def _complete():
+        response = get_client().chat.completions.create(
+            model=GPT_MODEL,
+            messages=[
+                {"role": "system", "content": GPT_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=temperature
+        )
+        return response.choices[0].message.content.strip()
+    return gpt_flights.do(flight_key(GPT_MODEL, GPT_SYSTEM_PROMPT, prompt, temperature),
+                          lambda: llm_cache.get_or_compute(GPT_MODEL, GPT_SYSTEM_PROMPT, prompt, temperature, family, _complete))
 
 def get_real_time_inputs(location="London"):
     def fetch_rainfall_forecast():
         try:
+            import requests
             coords = {
                 "London": (51.5074, -0.1278),
                 "Manchester": (53.4808, -2.2426),
@@ -87,7 +109,7 @@ def predict_overflow(inputs):
     Predict if an overflow is likely in the next 12 hours. Provide reasoning.
     Simulate sewer network behavior based on rainfall and flow rates. Indicate if rerouting is needed.
     """
-    return call_gpt(prompt)
+    return call_gpt(prompt, family="analysis")
 
 def dynamic_control_advice(inputs):
     prompt = f"""
@@ -105,7 +127,7 @@ def dynamic_control_advice(inputs):
     - Delay discharges if necessary
     Suggest how these actions reduce risk and improve system performance.
     """
-    return call_gpt(prompt)
+    return call_gpt(prompt, family="analysis")
 
 def detect_anomalies(inputs):
     prompt = f"""
@@ -119,7 +141,7 @@ def detect_anomalies(inputs):
     Identify potential equipment failures and asset reliability issues.
     Recommend proactive maintenance steps that can lower long-term cost and extend equipment lifespan.
     """
-    return call_gpt(prompt)
+    return call_gpt(prompt, family="analysis")
 
 def compliance_check(inputs):
     prompt = f"""
@@ -132,17 +154,142 @@ def compliance_check(inputs):
     Determine if there is a compliance breach.
     Recommend necessary interventions to meet discharge regulations.
     """
-    return call_gpt(prompt)
+    return call_gpt(prompt, family="analysis")
+
+ANALYSES = {
+    "Overflow Prediction": predict_overflow,
+    "Dynamic Control Advisory": dynamic_control_advice,
+    "Anomaly Detection": detect_anomalies,
+    "Compliance Check": compliance_check
+}
+ANALYSIS_CONCURRENCY = int(os.getenv("WATER_LLM_ANALYSIS_CONCURRENCY", "8"))
+ANALYSIS_DEADLINE = float(os.getenv("WATER_LLM_ANALYSIS_DEADLINE", "60"))
+_analysis_pool = ThreadPoolExecutor(max_workers=ANALYSIS_CONCURRENCY, thread_name_prefix="analysis")
+
+def _timed(analysis, inputs):
+    start = time.perf_counter()
+    result = analysis(inputs)
+    return result, time.perf_counter() - start
+
+def _run_analyses_concurrently(all_inputs, deadline):
+    """Issue every GPT analysis at once on the shared pool; all share one deadline."""
+    futures = {name: _analysis_pool.submit(_timed, analysis, all_inputs) for name, analysis in ANALYSES.items()}
+    wait(futures.values(), timeout=deadline)
+    results, timings = {}, {}
+    for name, future in futures.items():
+        if future.done():
+            results[name], timings[name] = future.result()
+        else:
+            future.cancel()
+            results[name] = f"⚠️ {name} did not complete within {deadline}s."
+            timings[name] = None
+    return results, timings
+
+def _run_analyses_sequentially(all_inputs):
+    results, timings = {}, {}
+    for name, analysis in ANALYSES.items():
+        results[name], timings[name] = _timed(analysis, all_inputs)
+    return results, timings
+
+# JSON field carrying each analysis in the combined (single call) mode.
+COMBINED_ANALYSIS_FIELDS = {
+    "Overflow Prediction": "overflow_prediction",
+    "Dynamic Control Advisory": "control_advisory",
+    "Anomaly Detection": "anomaly_detection",
+    "Compliance Check": "compliance_check"
+}
+
+def combined_analysis_prompt(inputs):
+    """One prompt covering all four analyses, with the input table sent once."""
+    schema = json.dumps({
+        "type": "object",
+        "required": list(COMBINED_ANALYSIS_FIELDS.values()),
+        "properties": {field: {"type": "string"} for field in COMBINED_ANALYSIS_FIELDS.values()}
+    })
+    return f"""
+    The Water LLM Engine is analyzing stormwater infrastructure data.
+    Inputs:
+    - Rainfall forecast: {inputs['rainfall_forecast']} mm
+    - Inflow rate: {inputs['inflow_rate']} L/s
+    - Outflow rate: {inputs['outflow_rate']} L/s
+    - Tank level: {inputs['tank_level']} %
+    - Tank capacity: {inputs['tank_capacity']} L
+    - Pump 1 speed: {inputs['pump_speed']} RPM
+    - Valve A status: {inputs['valve_a_status']}
+    - Overflow risk: {inputs['overflow_risk']}
+    - Pump vibration: {inputs['pump_vibration']} mm/s
+    - Valve response delay: {inputs['valve_delay']} seconds
+    - Sensor reliability score: {inputs['sensor_score']}/10
+    - Unexpected level drop: {inputs['level_drop']} %
+    - Overflow duration: {inputs['overflow_duration']} minutes
+    - Overflow frequency this month: {inputs['overflow_count']} times
+    - Treated before discharge: {inputs['treated']}
+    - Regulatory context: EA stormwater rules (UK)
+
+    Complete four tasks:
+    1. overflow_prediction: Predict if an overflow is likely in the next 12 hours. Provide reasoning.
+       Simulate sewer network behavior based on rainfall and flow rates. Indicate if rerouting is needed.
+    2. control_advisory: Recommend immediate control actions (pump speed, valves, redirecting water to
+       storm or detention tanks, delaying discharges) and explain how they reduce risk and improve performance.
+    3. anomaly_detection: Identify potential equipment failures and asset reliability issues.
+       Recommend proactive maintenance steps that can lower long-term cost and extend equipment lifespan.
+    4. compliance_check: Determine if there is a compliance breach.
+       Recommend necessary interventions to meet discharge regulations.
+
+    Respond with a single JSON object and nothing else, matching this JSON schema:
+    {schema}
+    """
 
-def run_all_analyses(all_inputs, location, scada_enabled=False):
+def parse_combined_analysis(text):
+    """Map a combined JSON answer back to result keys, or None if it is unusable."""
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    results = {}
+    for name, field in COMBINED_ANALYSIS_FIELDS.items():
+        value = data.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return None
+        results[name] = value.strip()
+    return results
+
+def _run_analyses_combined(all_inputs, deadline):
+    """One structured GPT call for all analyses; falls back to per-analysis calls if it cannot be parsed."""
+    prompt = combined_analysis_prompt(all_inputs)
+    start = time.perf_counter()
+    try:
+        results = parse_combined_analysis(call_gpt(prompt, family="analysis"))
+    except Exception as e:
+        print(f"⚠️ Combined analysis call failed: {e}")
+        results = None
+    elapsed = time.perf_counter() - start
+    if results is not None:
+        return results, {"Combined Call": elapsed}
+    print("⚠️ Combined analysis response could not be parsed; falling back to per-analysis calls.")
+    llm_cache.discard(cache_key(GPT_MODEL, GPT_SYSTEM_PROMPT, prompt, 0.3))
+    results, timings = _run_analyses_concurrently(all_inputs, deadline)
+    timings["Combined Call"] = elapsed
+    return results, timings
+
+ANALYSIS_MODES = {
+    "concurrent": _run_analyses_concurrently,
+    "sequential": lambda all_inputs, deadline: _run_analyses_sequentially(all_inputs),
+    "combined": _run_analyses_combined
+}
+ANALYSIS_MODE = os.getenv("WATER_LLM_ANALYSIS_MODE", "concurrent")
+
+def run_all_analyses(all_inputs, location, scada_enabled=False, mode=ANALYSIS_MODE, deadline=ANALYSIS_DEADLINE):
     print("\n📥 Water LLM Engine is analyzing current state and generating recommendations...")
 
-    results = {
-        "Overflow Prediction": predict_overflow(all_inputs),
-        "Dynamic Control Advisory": dynamic_control_advice(all_inputs),
-        "Anomaly Detection": detect_anomalies(all_inputs),
-        "Compliance Check": compliance_check(all_inputs)
-    }
+    started = time.perf_counter()
+    results, timings = ANALYSIS_MODES[mode](all_inputs, deadline)
+    timings["Total"] = time.perf_counter() - started
 
     # Self-learning placeholder (refine future recommendations based on past data)
     # e.g., analyze log file trends or scoring
@@ -157,6 +304,8 @@ def run_all_analyses(all_inputs, location, scada_enabled=False):
     else:
         results["SCADA Feedback"] = "⚠️ SCADA integration not enabled. Actions are advisory only."
 
+    results["Analysis Timings"] = {name: round(seconds, 3) if seconds is not None else None for name, seconds in timings.items()}
+
     log_entry = {
         "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "location": location,
@@ -164,25 +313,44 @@ def run_all_analyses(all_inputs, location, scada_enabled=False):
         "results": results,
         "scada_enabled": scada_enabled
     }
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(json.dumps(log_entry) + "\n")
+    # Queued for the background writer, which folds the entry into the report aggregates once written.
+    _log_aggregates()
+    log_writer.write_json(LOG_FILE, log_entry)
     print("✅ Intervention logged.")
     return results
 
-def get_logged_interventions():
-    if not os.path.exists(LOG_FILE):
-        return []
-    entries = []
-    with open(LOG_FILE, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                entries.append(json.loads(line))
-            except json.JSONDecodeError:
-                print(f"⚠️ Skipping malformed log line: {line[:80]}...")
-    return entries
+_log_indexes = {}
+
+def _log_index():
+    """Sidecar offset index for the current LOG_FILE (see log_index.py)."""
+    index = _log_indexes.get(LOG_FILE)
+    if index is None:
+        index = _log_indexes[LOG_FILE] = LogIndex(LOG_FILE)
+    return index
+
+_log_aggregate_stores = {}
+
+def _log_aggregates():
+    """Materialised report/upgrade aggregates for the current LOG_FILE (see log_aggregates.py)."""
+    aggregates = _log_aggregate_stores.get(LOG_FILE)
+    if aggregates is None:
+        aggregates = _log_aggregate_stores[LOG_FILE] = LogAggregates(LOG_FILE, index=_log_index())
+        log_writer.on_flush(LOG_FILE, aggregates.refresh)
+    return aggregates
+
+def get_intervention_rollups(location=None, start=None, end=None):
+    """Daily per-location totals of logged entries, breaches and upgrade alerts."""
+    log_writer.flush(LOG_FILE)
+    return _log_aggregates().rollups(location, start, end)
+
+def iter_logged_interventions(last=None, start=None, end=None, location=None):
+    """Yield logged interventions oldest first, reading only the entries asked for:
+    the last N, those between start and end timestamps, and/or one location."""
+    log_writer.flush(LOG_FILE)
+    return _log_index().iter_entries(last=last, start=start, end=end, location=location)
+
+def get_logged_interventions(last=None, start=None, end=None, location=None):
+    return list(iter_logged_interventions(last, start, end, location))
 
 
 
@@ -223,47 +391,34 @@ def get_parameter_descriptions():
         "treated": "Was the overflow water treated before discharge?"
     }
 
-def generate_regulatory_report(logs):
-    """Returns a list of breach summaries for recent UWWTR/SODRP reporting."""
-    report = []
-    for entry in logs:
-        if entry["results"].get("Compliance Check", "").lower().find("breach") != -1:
-            report.append({
-                "timestamp": entry["timestamp"],
-                "location": entry["location"],
-                "overflow_duration": entry["inputs"].get("overflow_duration", "N/A"),
-                "overflow_count": entry["inputs"].get("overflow_count", "N/A"),
-                "treated": entry["inputs"].get("treated", "N/A"),
-                "compliance_status": entry["results"].get("Compliance Check", "N/A")
-            })
+def generate_regulatory_report(logs=None, location=None):
+    """Returns a list of breach summaries for recent UWWTR/SODRP reporting.
+
+    Without logs, reads the breach list kept up to date as entries are logged."""
+    if logs is None:
+        log_writer.flush(LOG_FILE)
+        report = _log_aggregates().breaches(location)
+    else:
+        report = [breach for breach in map(breach_record, logs)
+                  if breach is not None and (location is None or breach["location"] == location)]
     return {
         "total_breaches": len(report),
         "breach_details": report
     }
 
-def recommend_infrastructure_upgrades(logs):
-    """Analyzes recurring failures to recommend long-term upgrades."""
-    from collections import Counter
-    vibration_alerts = []
-    valve_delays = []
-    level_drops = []
+def recommend_infrastructure_upgrades(logs=None):
+    """Analyzes recurring failures to recommend long-term upgrades.
 
+    Without logs, reads the per-location counters kept up to date as entries are logged."""
+    if logs is None:
+        log_writer.flush(LOG_FILE)
+        return _log_aggregates().upgrade_zones()
+    from collections import Counter
+    zones = {label: Counter() for label in UPGRADE_ZONES}
     for entry in logs:
-        v = entry["inputs"].get("pump_vibration", 0)
-        d = entry["inputs"].get("valve_delay", 0)
-        l = entry["inputs"].get("level_drop", 0)
-        if v > 2.0:
-            vibration_alerts.append(entry["location"])
-        if d > 5:
-            valve_delays.append(entry["location"])
-        if l > 10:
-            level_drops.append(entry["location"])
-
-    return {
-        "High Vibration Zones": dict(Counter(vibration_alerts)),
-        "Frequent Valve Delay Zones": dict(Counter(valve_delays)),
-        "Potential Leak Zones": dict(Counter(level_drops))
-    }
+        for label in upgrade_zones(entry):
+            zones[label][entry["location"]] += 1
+    return {label: dict(counts) for label, counts in zones.items()}
 
 def actuate_asset(command):
     """Send a mock or real command to SCADA. In production, connect to actual API."""
@@ -278,4 +433,4 @@ def alert_operator(risk, action):
 def suggest_action_for_risk(risk_description):
     """Uses GPT to recommend an operational action for a given risk."""
     prompt = f"As a water system operations expert, suggest an appropriate recommended action for the following risk:\n\n'{risk_description}'\n\nKeep the response concise."
-    return call_gpt(prompt)
\ No newline at end of file
+    return call_gpt(prompt, family="risk_action")
\ No newline at end of file
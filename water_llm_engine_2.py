@@ -1,14 +1,22 @@
-import openai
-
 import os
-openai.api_key = os.getenv("OPENAI_API_KEY")
 import json
-import sqlite3
-import requests
+import asyncio
+import time
 import datetime
-import paho.mqtt.publish as mqtt
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from dataclasses import dataclass, field
 from dotenv import load_dotenv
 from pydantic import BaseModel
+from protocol_sessions import protocol_pool, protocol_available, MODBUS_COMMAND_REGISTER
+from llm_cache import llm_cache, cache_key, flight_key
+from singleflight import SingleFlight, AsyncSingleFlight
+from job_store import JobStore, SqliteJobStore
+from storm_leases import storm_leases
+from telemetry_history import telemetry_history
+from stage_dag import StageGraph
+from config_store import IntegrationConfigCache, CsvConfigRegistry, parse_number
+from threshold_rules import ThresholdRuleRegistry, DEFAULT_RULES
 
 class WeatherData(BaseModel):
     rainfall_mm: float
@@ -20,211 +28,560 @@ class SensorData(BaseModel):
 import logging
 from tenacity import retry, stop_after_attempt, wait_fixed
 from pydantic import BaseModel, ValidationError
-logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s', handlers=[logging.FileHandler('logs/water_llm_structured.log'), logging.StreamHandler()])
+from log_writer import log_writer
 logger = logging.getLogger('WaterLLM')
 
+STRUCTURED_LOG = 'logs/water_llm_structured.log'
+_logging_lock = threading.Lock()
+_logging_configured = False
+
+def configure_logging():
+    """Send log records through log_writer to the console and the structured log.
+
+    Runs once, from the FastAPI lifespan or on the first WaterLLM record, so
+    importing the engine starts no threads and touches no files.
+    """
+    global _logging_configured
+    with _logging_lock:
+        if _logging_configured:
+            return
+        _logging_configured = True
+        logger.removeHandler(_deferred_logging)
+    logging.basicConfig(level=logging.INFO, handlers=[log_writer.queue_logging_handler(STRUCTURED_LOG, '%(asctime)s [%(levelname)s] %(message)s')])
+
+class _DeferredLoggingSetup(logging.Handler):
+    """Configures logging when the first WaterLLM record arrives; the record then propagates to it."""
+
+    def emit(self, record):
+        configure_logging()
+
+_deferred_logging = _DeferredLoggingSetup()
+logger.addHandler(_deferred_logging)
+logger.setLevel(logging.INFO)
+
+HTTP_TIMEOUT = float(os.getenv('WATER_LLM_HTTP_TIMEOUT', '10'))
+HTTP_MAX_CONNECTIONS = int(os.getenv('WATER_LLM_HTTP_MAX_CONNECTIONS', '200'))
+
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(1))
 def post_scada_command(scada_api, command, token):
     """Post scada command function."""
-    return requests.post(scada_api, json={'command': command}, headers={'Authorization': f'Bearer {token}'})
+    import requests
+    return requests.post(scada_api, json={'command': command}, headers={'Authorization': f'Bearer {token}'}, timeout=HTTP_TIMEOUT)
 
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(1))
 def send_mqtt_message(broker, topic, command):
-    """Send mqtt message function."""
-    mqtt.single(topic, payload=command, hostname=broker)
+    """Send mqtt message function (pooled session per broker)."""
+    protocol_pool.mqtt(broker).publish(topic, command)
 
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(1))
 def send_opcua_command(url, command):
-    """Send opcua command function."""
-    opc = OPCUAClient(url)
-    opc.connect()
-    node = opc.get_objects_node().get_child(['0:MyDevice', '0:Command'])
-    node.set_value(command)
-    opc.disconnect()
+    """Send opcua command function (pooled session per server URL)."""
+    protocol_pool.opcua(url).write_command(command)
 
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(1))
 def send_modbus_command(ip, port, command):
-    """Send modbus command function."""
-    plc = ModbusTcpClient(ip, port=int(port))
-    plc.connect()
-    plc.write_register(1, int(command) if command.isdigit() else 1)
-    plc.close()
-try:
-    from opcua import Client as OPCUAClient
-except ImportError:
-    OPCUAClient = None
-try:
-    from pymodbus.client import ModbusTcpClient
-except ImportError:
-    ModbusTcpClient = None
+    """Send modbus command function (pooled session per PLC)."""
+    protocol_pool.modbus(ip, port).write_register(MODBUS_COMMAND_REGISTER, int(command) if command.isdigit() else 1)
 load_dotenv()
 
 DB_PATH = 'integration.db'
 LOG_FILE = 'logs/water_llm_log.json'
-os.makedirs('logs', exist_ok=True)
+integration_config_cache = IntegrationConfigCache(DB_PATH)
+threshold_rules = ThresholdRuleRegistry(DB_PATH)
+tank_config_registry = CsvConfigRegistry('tank_config.csv', converters={'capacity': parse_number})
+asset_config_registry = CsvConfigRegistry('asset_config.csv')
+river_impact_registry = CsvConfigRegistry('river_impact_config.csv')
 
 def get_integration_config(location='London'):
-    """Get integration config function."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM integration_config WHERE location=?', (location,))
-    row = cursor.fetchone()
-    conn.close()
-    if row:
-        columns = ['id', 'location', 'scada_api', 'mqtt_broker', 'mqtt_topic', 'opcua_url', 'plc_ip', 'plc_port', 'auth_token', 'weather_api', 'weather_coords', 'sensor_vendor', 'sensor_endpoint', 'notes']
-        return dict(zip(columns, row))
-    return {}
-
-def actuate_asset(command, location='London'):
+    """Get integration config function (served from the in-memory config cache)."""
+    return integration_config_cache.get(location)
+
+# Each protocol gets its own deadline; all configured protocols are dispatched
+# at once so actuation latency is the slowest channel rather than the sum.
+ACTUATION_DEADLINES = {
+    'SCADA': float(os.getenv('WATER_LLM_SCADA_DEADLINE', '10')),
+    'MQTT': float(os.getenv('WATER_LLM_MQTT_DEADLINE', '10')),
+    'OPC-UA': float(os.getenv('WATER_LLM_OPCUA_DEADLINE', '10')),
+    'PLC': float(os.getenv('WATER_LLM_PLC_DEADLINE', '10')),
+}
+_actuation_pool = ThreadPoolExecutor(max_workers=int(os.getenv('WATER_LLM_ACTUATION_WORKERS', '32')), thread_name_prefix='actuation')
+
+def _send_scada_checked(scada_api, command, token):
+    """Post a SCADA command and raise on an HTTP error status."""
+    post_scada_command(scada_api, command, token).raise_for_status()
+
+def _actuation_channels(command, config):
+    """List (protocol, success message, error prefix, sender) for every channel configured for a site."""
+    channels = []
+    if config.get('scada_api'):
+        channels.append(('SCADA', '✅ SCADA Command Sent', '❌ SCADA Error', lambda: _send_scada_checked(config['scada_api'], command, config.get('auth_token', ''))))
+    if config.get('mqtt_broker') and config.get('mqtt_topic'):
+        channels.append(('MQTT', '✅ MQTT Command Published', '❌ MQTT Error', lambda: send_mqtt_message(config['mqtt_broker'], config['mqtt_topic'], command)))
+    if config.get('opcua_url') and protocol_available('opcua'):
+        channels.append(('OPC-UA', '✅ OPC-UA Command Written', '❌ OPC-UA Error', lambda: send_opcua_command(config['opcua_url'], command)))
+    if config.get('plc_ip') and config.get('plc_port') and protocol_available('pymodbus'):
+        channels.append(('PLC', '✅ PLC Modbus Command Sent', '❌ PLC Error', lambda: send_modbus_command(config['plc_ip'], config['plc_port'], command)))
+    return channels
+
+def actuate_asset(command, location='London', config=None):
     """Actuate asset function."""
-    config = get_integration_config(location)
+    if config is None:
+        config = get_integration_config(location)
     results = {}
     logger.info(f"🔐 Actuation command: {command} for {location} | Config Source: {config.get('sensor_vendor', 'N/A')}")
-    scada_api = config.get('scada_api')
-    if scada_api:
+    started = time.monotonic()
+    pending = [(name, ok, err, _actuation_pool.submit(sender)) for name, ok, err, sender in _actuation_channels(command, config)]
+    for name, ok, err, future in pending:
+        deadline = ACTUATION_DEADLINES.get(name, HTTP_TIMEOUT)
         try:
-            r = post_scada_command(scada_api, command, config.get('auth_token', ''))
-            r.raise_for_status()
-            results['SCADA'] = '✅ SCADA Command Sent'
+            future.result(timeout=max(0.0, started + deadline - time.monotonic()))
+            results[name] = ok
+        except FuturesTimeoutError:
+            results[name] = f'{err}: no response within {deadline}s'
         except Exception as e:
-            results['SCADA'] = f'❌ SCADA Error: {str(e)}'
-    if config.get('mqtt_broker') and config.get('mqtt_topic'):
-        try:
-            send_mqtt_message(config['mqtt_broker'], config['mqtt_topic'], command)
-            results['MQTT'] = '✅ MQTT Command Published'
-        except Exception as e:
-            results['MQTT'] = f'❌ MQTT Error: {str(e)}'
-    if OPCUAClient and config.get('opcua_url'):
-        try:
-            send_opcua_command(config['opcua_url'], command)
-            results['OPC-UA'] = '✅ OPC-UA Command Written'
-        except Exception as e:
-            results['OPC-UA'] = f'❌ OPC-UA Error: {str(e)}'
-    if ModbusTcpClient and config.get('plc_ip') and config.get('plc_port'):
-        try:
-            send_modbus_command(config['plc_ip'], config['plc_port'], command)
-            results['PLC'] = '✅ PLC Modbus Command Sent'
-        except Exception as e:
-            results['PLC'] = f'❌ PLC Error: {str(e)}'
+            results[name] = f'{err}: {str(e)}'
     return results
 
-def fetch_weather_data(location='London'):
+def _record_telemetry(location, payload, prefix):
+    """Keep the numeric fields of a fetched payload in the in-process and durable telemetry history."""
+    if isinstance(payload, dict) and 'error' not in payload:
+        from telemetry_store import telemetry
+        telemetry.record(location, payload, prefix)
+        telemetry_history.record_payload(location, payload, prefix)
+    return payload
+
+def _record_risk(location, risk, rain_mm, tank_fill_percent):
+    """Persist a risk evaluation alongside the telemetry it was made from."""
+    telemetry_history.record(location, 'risk.level', RISK_CODES.get(risk), text=f'{risk} (rain {rain_mm}mm, fill {tank_fill_percent}%)')
+    return risk
+
+def telemetry_history_range(location='London', signal='sensors.tank_fill_percent', start_ms=None, end_ms=None, limit=None):
+    """Persisted points of a signal in a time range (epoch milliseconds), oldest first."""
+    return {'location': location, 'signal': signal, 'points': telemetry_history.query(location, signal, start_ms, end_ms, limit)}
+
+def recent_telemetry(location='London', signal='sensors.tank_fill_percent', n=60):
+    """Latest n samples of a recorded signal, e.g. 'sensors.tank_fill_percent' or 'weather.rainfall_mm'."""
+    from telemetry_store import telemetry
+    timestamps, values = telemetry.window(location, signal, n)
+    return {'location': location, 'signal': signal, 'timestamps': (timestamps // 1_000_000).tolist(), 'values': values.tolist()}
+
+def _request_weather(config):
+    """Weather payload from a location's configured feed, without recording it."""
+    api = config.get('weather_api')
+    if not api:
+        return 'No weather API configured.'
+    try:
+        import requests
+        return requests.get(api, timeout=HTTP_TIMEOUT).json()
+    except Exception as e:
+        return {'error': str(e)}
+
+def _request_sensors(config):
+    """Sensor payload from a location's configured endpoint, without recording it."""
+    endpoint = config.get('sensor_endpoint')
+    if not endpoint:
+        return 'No sensor API configured.'
+    try:
+        import requests
+        return requests.get(endpoint, timeout=HTTP_TIMEOUT).json()
+    except Exception as e:
+        return {'error': str(e)}
+
+def fetch_weather_data(location='London', config=None):
     """Fetch weather data function."""
+    if config is None:
+        config = get_integration_config(location)
+    return _record_telemetry(location, _request_weather(config), 'weather.')
+
+def fetch_sensor_data(location='London', config=None):
+    """Fetch sensor data function."""
+    if config is None:
+        config = get_integration_config(location)
+    return _record_telemetry(location, _request_sensors(config), 'sensors.')
+
+def _load_openai():
+    """Import the OpenAI SDK on first use rather than at module import."""
+    import openai
+    return openai
+
+GPT_MODEL = "gpt-4"
+GPT_SYSTEM_PROMPT = "You are a water infrastructure expert and regulatory advisor."
+# Point at an OpenAI-compatible server (e.g. mock_openai_server.py) instead of api.openai.com.
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+_openai_client = None
+# Identical prompts already in flight share one completion instead of each calling upstream.
+gpt_flights = SingleFlight()
+async_gpt_flights = AsyncSingleFlight()
+
+def get_openai_client():
+    """Return the process-wide OpenAI client, creating it on first use."""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = _load_openai().OpenAI(api_key=os.getenv('OPENAI_API_KEY'), base_url=OPENAI_BASE_URL)
+    return _openai_client
+
+# What call_gpt and friends return instead of raising when the completion fails.
+GPT_FAILED = 'OpenAI call failed.'
+
+@retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
+def call_gpt(prompt, temperature=0.3, family='default'):
+    """Call GPT through the OpenAI v1 SDK client.
+
+    Completions are served from llm_cache when an unexpired answer exists;
+    family selects the cache TTL. Concurrent calls with the same prompt share
+    one upstream completion through gpt_flights.
+    """
+    def _complete():
+        response = get_openai_client().chat.completions.create(model=GPT_MODEL,messages=[
+                {"role": "system", "content": GPT_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=temperature
+        )
+        return response.choices[0].message.content.strip()
+    try:
+        return gpt_flights.do(flight_key(GPT_MODEL, GPT_SYSTEM_PROMPT, prompt, temperature),
+                              lambda: llm_cache.get_or_compute(GPT_MODEL, GPT_SYSTEM_PROMPT, prompt, temperature, family, _complete))
+    except Exception as e:
+        logger.error(f'❌ OpenAI call failed: {e}')
+        return GPT_FAILED
+
+# ---------------------------------------------------------------------------
+# Async execution path: one pooled httpx client shared by every coroutine in
+# the process, so a slow upstream parks a coroutine instead of a worker thread.
+# ---------------------------------------------------------------------------
+_async_http_client = None
+_async_openai_client = None
+
+def get_async_http_client():
+    """Return the process-wide pooled async HTTP client, creating it on first use."""
+    global _async_http_client
+    if _async_http_client is None or _async_http_client.is_closed:
+        import httpx
+        _async_http_client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS // 4),
+        )
+    return _async_http_client
+
+def get_async_openai_client():
+    """Return an AsyncOpenAI client that rides on the shared HTTP connection pool."""
+    global _async_openai_client
+    if _async_openai_client is None:
+        _async_openai_client = _load_openai().AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), base_url=OPENAI_BASE_URL, http_client=get_async_http_client())
+    return _async_openai_client
+
+async def close_async_http_client():
+    """Close the shared async HTTP client (called on application shutdown)."""
+    global _async_http_client, _async_openai_client
+    if _async_http_client is not None:
+        await _async_http_client.aclose()
+    _async_http_client = None
+    _async_openai_client = None
+
+@retry(stop=stop_after_attempt(3), wait=wait_fixed(1))
+async def post_scada_command_async(scada_api, command, token):
+    """Async variant of post_scada_command."""
+    return await get_async_http_client().post(scada_api, json={'command': command}, headers={'Authorization': f'Bearer {token}'})
+
+async def fetch_weather_data_async(location='London'):
+    """Async variant of fetch_weather_data."""
     config = get_integration_config(location)
     api = config.get('weather_api')
     if not api:
         return 'No weather API configured.'
     try:
-        response = requests.get(api)
-        return response.json()
+        response = await get_async_http_client().get(api)
+        return _record_telemetry(location, response.json(), 'weather.')
     except Exception as e:
         return {'error': str(e)}
 
-def fetch_sensor_data(location='London'):
-    """Fetch sensor data function."""
+async def fetch_sensor_data_async(location='London'):
+    """Async variant of fetch_sensor_data."""
     config = get_integration_config(location)
     endpoint = config.get('sensor_endpoint')
     if not endpoint:
         return 'No sensor API configured.'
     try:
-        response = requests.get(endpoint)
-        return response.json()
+        response = await get_async_http_client().get(endpoint)
+        return _record_telemetry(location, response.json(), 'sensors.')
     except Exception as e:
         return {'error': str(e)}
 
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-def call_gpt(prompt, temperature=0.3):
-    """Call GPT using standard OpenAI SDK (compatible across versions)."""
-    try:
-        response = openai.ChatCompletion.create(model="gpt-4",messages=[
-                {"role": "system", "content": "You are a water infrastructure expert and regulatory advisor."},
+async def call_gpt_async(prompt, temperature=0.3, family='default'):
+    """Async variant of call_gpt using the AsyncOpenAI client."""
+    async def _complete():
+        key = cache_key(GPT_MODEL, GPT_SYSTEM_PROMPT, prompt, temperature)
+        cached = await llm_cache.get_async(key)
+        if cached is not None:
+            return cached
+        response = await get_async_openai_client().chat.completions.create(model=GPT_MODEL, messages=[
+                {"role": "system", "content": GPT_SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
             temperature=temperature
         )
-        return response.choices[0].message['content'].strip()
+        content = response.choices[0].message.content.strip()
+        if content:
+            await llm_cache.put_async(key, content, family)
+        return content
+    try:
+        return await async_gpt_flights.do(flight_key(GPT_MODEL, GPT_SYSTEM_PROMPT, prompt, temperature), _complete)
     except Exception as e:
         logger.error(f'❌ OpenAI call failed: {e}')
-        return 'OpenAI call failed.'
+        return GPT_FAILED
+
+class LLMStreamInterrupted(Exception):
+    """Raised when a GPT stream fails after part of the answer has been yielded."""
+
+async def stream_gpt_async(prompt, temperature=0.3, family='default'):
+    """Yield GPT output incrementally as it arrives; cached answers are yielded in one piece.
 
-def calculate_overflow_risk(rain_mm, tank_fill_percent):
+    A failure before any output yields GPT_FAILED like call_gpt; a
+    failure part-way raises LLMStreamInterrupted so the answer is not taken as complete.
+    """
+    key = cache_key(GPT_MODEL, GPT_SYSTEM_PROMPT, prompt, temperature)
+    cached = await llm_cache.get_async(key)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    try:
+        stream = await get_async_openai_client().chat.completions.create(model=GPT_MODEL, messages=[
+                {"role": "system", "content": GPT_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=temperature,
+            stream=True
+        )
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+    except Exception as e:
+        logger.error(f'❌ OpenAI streaming call failed: {e}')
+        if parts:
+            raise LLMStreamInterrupted(f'GPT stream interrupted after {len(parts)} chunks: {e}') from e
+        yield GPT_FAILED
+        return
+    text = ''.join(parts).strip()
+    if text:
+        await llm_cache.put_async(key, text, family)
+
+async def _send_scada_checked_async(scada_api, command, token):
+    """Async variant of _send_scada_checked."""
+    (await post_scada_command_async(scada_api, command, token)).raise_for_status()
+
+async def _dispatch_channel_async(name, ok, err, sender):
+    """Await one actuation channel under its deadline and format the outcome."""
+    deadline = ACTUATION_DEADLINES.get(name, HTTP_TIMEOUT)
+    try:
+        await asyncio.wait_for(sender, timeout=deadline)
+        return ok
+    except asyncio.TimeoutError:
+        return f'{err}: no response within {deadline}s'
+    except Exception as e:
+        return f'{err}: {str(e)}'
+
+async def actuate_asset_async(command, location='London', config=None):
+    """Async variant of actuate_asset; SCADA goes over the shared HTTP pool, field protocols via the actuation pool."""
+    if config is None:
+        config = get_integration_config(location)
+    logger.info(f"🔐 Actuation command: {command} for {location} | Config Source: {config.get('sensor_vendor', 'N/A')}")
+    loop = asyncio.get_running_loop()
+    names, dispatches = [], []
+    for name, ok, err, sender in _actuation_channels(command, config):
+        if name == 'SCADA':
+            awaitable = _send_scada_checked_async(config['scada_api'], command, config.get('auth_token', ''))
+        else:
+            awaitable = loop.run_in_executor(_actuation_pool, sender)
+        names.append(name)
+        dispatches.append(_dispatch_channel_async(name, ok, err, awaitable))
+    return dict(zip(names, await asyncio.gather(*dispatches)))
+
+def get_threshold_rules(location='London'):
+    """Compiled threshold rules for a location (see threshold_rules.py)."""
+    return threshold_rules.get(location)
+
+def calculate_overflow_risk(rain_mm, tank_fill_percent, rules=DEFAULT_RULES):
     """
     Calculate overflow risk score based on rainfall and tank fill level.
     """
-    if rain_mm > 20 and tank_fill_percent > 90:
-        return 'HIGH'
-    elif rain_mm > 10 and tank_fill_percent > 75:
-        return 'MEDIUM'
-    return 'LOW'
-
-def overflow_control(location):
-    """Overflow control function."""
+    return rules.overflow_risk(rain_mm, tank_fill_percent)
+
+OVERFLOW_COMMANDS = {'HIGH': 'open_overflow_valve', 'MEDIUM': 'start_buffer_pump'}
+RISK_CODES = {'LOW': 0, 'MEDIUM': 1, 'HIGH': 2}
+NO_ACTION_REQUIRED = '🟢 No control action required'
+
+def _extract_overflow_inputs(weather, sensor):
+    """Pull rainfall and tank fill out of raw weather/sensor payloads."""
+    rain_mm = weather.get('forecast', {}).get('rainfall_mm', 0)
+    tank_fill = sensor.get('telemetry', {}).get('tank_fill_percent', 0)
+    return rain_mm, tank_fill
+
+def _overflow_result(location, rain_mm, tank_fill, risk, action):
+    """Assemble the overflow_control response around an actuation outcome."""
+    result = {'rain_mm': rain_mm, 'tank_fill_percent': tank_fill, 'risk': risk, 'action': action}
+    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    result['log'] = {'timestamp': timestamp, 'location': location, 'rainfall_mm': rain_mm, 'tank_fill_percent': tank_fill, 'risk': risk, 'action': result['action'] if isinstance(result['action'], str) else list(result['action'].values())[0]}
+    result['report'] = f"Overflow control executed at {timestamp} with risk: {risk} and action taken: {result['action']}"
+    return result
+
+def _overflow_advisory_prompt(location, risk):
+    """Prompt used for the overflow_control GPT advisory."""
+    return f'What are the next steps for a {risk} overflow scenario at {location}?'
+
+# Deferred overflow advisories: the rule-based answer returns at once and the GPT
+# advisory is produced in the background, collected later by job id.
+ADVISORY_JOB_TTL = int(os.getenv('WATER_LLM_ADVISORY_JOB_TTL', '3600'))
+advisory_jobs = JobStore(ttl=ADVISORY_JOB_TTL)
+_advisory_pool = ThreadPoolExecutor(max_workers=int(os.getenv('WATER_LLM_ADVISORY_WORKERS', '8')), thread_name_prefix='advisory')
+_advisory_tasks = set()
+
+def _settle_advisory_job(job_id, advisory):
+    """Finish a job with its advisory, or fail it if the GPT call did not produce one."""
+    if advisory == GPT_FAILED:
+        advisory_jobs.fail(job_id, advisory)
+    else:
+        advisory_jobs.finish(job_id, advisory)
+
+def _run_advisory_job(job_id, prompt):
+    """Produce a deferred advisory on the advisory pool."""
+    advisory_jobs.start(job_id)
+    try:
+        _settle_advisory_job(job_id, call_gpt(prompt, family='overflow_advisory'))
+    except Exception as e:
+        logger.error(f'❌ Advisory job {job_id} failed: {e}')
+        advisory_jobs.fail(job_id, e)
+
+async def _run_advisory_job_async(job_id, prompt):
+    """Produce a deferred advisory on the event loop."""
+    advisory_jobs.start(job_id)
+    try:
+        _settle_advisory_job(job_id, await call_gpt_async(prompt, family='overflow_advisory'))
+    except Exception as e:
+        logger.error(f'❌ Advisory job {job_id} failed: {e}')
+        advisory_jobs.fail(job_id, e)
+
+def _defer_advisory(result, location, risk, job_id):
+    """Mark an overflow result as awaiting its advisory job."""
+    result['advisory'] = None
+    result['advisory_job_id'] = job_id
+    result['advisory_status'] = 'pending'
+    logger.info(f'🕒 Advisory for {location} ({risk}) deferred as job {job_id}')
+    return result
+
+def get_advisory_job(job_id, wait=0):
+    """Status and, once done, the text of a deferred overflow advisory."""
+    return advisory_jobs.wait(job_id, wait) if wait else advisory_jobs.get(job_id)
+
+async def get_advisory_job_async(job_id, wait=0):
+    """Async variant of get_advisory_job; wait long-polls without holding a thread."""
+    return await advisory_jobs.wait_async(job_id, wait) if wait else advisory_jobs.get(job_id)
+
+def overflow_control(location, defer_advisory=False):
+    """Overflow control function.
+
+    With defer_advisory the GPT advisory is left to a background job and the
+    result carries its advisory_job_id instead of the advisory text.
+    """
     config = get_integration_config(location)
-    weather = fetch_weather_data(location)
-    sensor = fetch_sensor_data(location)
-    rain_mm = 0
-    tank_fill = 0
+    weather = fetch_weather_data(location, config)
+    sensor = fetch_sensor_data(location, config)
     try:
-        rain_mm = weather.get('forecast', {}).get('rainfall_mm', 0)
-        tank_fill = sensor.get('telemetry', {}).get('tank_fill_percent', 0)
+        rain_mm, tank_fill = _extract_overflow_inputs(weather, sensor)
     except Exception:
         return {'error': 'Failed to extract weather/sensor inputs.'}
-    risk = calculate_overflow_risk(rain_mm, tank_fill)
-    result = {'rain_mm': rain_mm, 'tank_fill_percent': tank_fill, 'risk': risk}
-    if risk == 'HIGH':
-        result['action'] = actuate_asset('open_overflow_valve', location)
-    elif risk == 'MEDIUM':
-        result['action'] = actuate_asset('start_buffer_pump', location)
+    risk = _record_risk(location, calculate_overflow_risk(rain_mm, tank_fill, get_threshold_rules(location)), rain_mm, tank_fill)
+    command = OVERFLOW_COMMANDS.get(risk)
+    action = actuate_asset(command, location, config) if command else NO_ACTION_REQUIRED
+    result = _overflow_result(location, rain_mm, tank_fill, risk, action)
+    prompt = _overflow_advisory_prompt(location, risk)
+    if defer_advisory:
+        job_id = advisory_jobs.create('overflow_advisory', location=location, risk=risk)
+        _advisory_pool.submit(_run_advisory_job, job_id, prompt)
+        _defer_advisory(result, location, risk, job_id)
     else:
-        result['action'] = '🟢 No control action required'
-    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    result['log'] = {'timestamp': timestamp, 'location': location, 'rainfall_mm': rain_mm, 'tank_fill_percent': tank_fill, 'risk': risk, 'action': result['action'] if isinstance(result['action'], str) else list(result['action'].values())[0]}
-    result['report'] = f"Overflow control executed at {timestamp} with risk: {risk} and action taken: {result['action']}"
-    result['advisory'] = call_gpt(f'What are the next steps for a {risk} overflow scenario at {location}?')
+        result['advisory'] = call_gpt(prompt, family='overflow_advisory')
     result['simulation_check'] = 'Data processed and verified successfully.'
     return result
 
-def get_real_time_inputs(location='London'):
+async def overflow_control_async(location, defer_advisory=False):
+    """Async variant of overflow_control; weather and sensor fetches run concurrently."""
+    weather, sensor = await asyncio.gather(fetch_weather_data_async(location), fetch_sensor_data_async(location))
+    try:
+        rain_mm, tank_fill = _extract_overflow_inputs(weather, sensor)
+    except Exception:
+        return {'error': 'Failed to extract weather/sensor inputs.'}
+    risk = _record_risk(location, calculate_overflow_risk(rain_mm, tank_fill, get_threshold_rules(location)), rain_mm, tank_fill)
+    command = OVERFLOW_COMMANDS.get(risk)
+    action = await actuate_asset_async(command, location) if command else NO_ACTION_REQUIRED
+    result = _overflow_result(location, rain_mm, tank_fill, risk, action)
+    prompt = _overflow_advisory_prompt(location, risk)
+    if defer_advisory:
+        job_id = advisory_jobs.create('overflow_advisory', location=location, risk=risk)
+        # Hold a reference so the task is not garbage collected before it finishes.
+        task = asyncio.ensure_future(_run_advisory_job_async(job_id, prompt))
+        _advisory_tasks.add(task)
+        task.add_done_callback(_advisory_tasks.discard)
+        _defer_advisory(result, location, risk, job_id)
+    else:
+        result['advisory'] = await call_gpt_async(prompt, family='overflow_advisory')
+    result['simulation_check'] = 'Data processed and verified successfully.'
+    return result
+
+def get_real_time_inputs(location='London', snapshot=None):
     """Get real time inputs function."""
-    weather = fetch_weather_data(location)
-    sensors = fetch_sensor_data(location)
+    if snapshot is not None:
+        return _build_real_time_inputs(location, snapshot.weather, snapshot.sensors)
+    config = get_integration_config(location)
+    weather = fetch_weather_data(location, config)
+    sensors = fetch_sensor_data(location, config)
+    return _build_real_time_inputs(location, weather, sensors)
+
+async def get_real_time_inputs_async(location='London'):
+    """Async variant of get_real_time_inputs."""
+    weather, sensors = await asyncio.gather(fetch_weather_data_async(location), fetch_sensor_data_async(location))
+    return _build_real_time_inputs(location, weather, sensors)
+
+def _build_real_time_inputs(location, weather, sensors):
+    """Flatten weather and sensor payloads into the analysis input dict."""
     return {'location': location, 'rainfall_mm': weather.get('rainfall_mm', 0), 'inflow_rate_lps': sensors.get('inflow_rate_lps', 0), 'tank_fill_percent': sensors.get('tank_fill_percent', 0), 'timestamp': weather.get('timestamp', datetime.datetime.now().isoformat())}
 
-def predict_overflow(rainfall_mm, tank_fill_percent):
+def predict_overflow(rainfall_mm, tank_fill_percent, rules=DEFAULT_RULES):
     """Predict overflow function."""
-    return rainfall_mm > 80 or tank_fill_percent > 90
+    return rules.predict_overflow(rainfall_mm, tank_fill_percent)
 
-def dynamic_control_advice(tank_fill_percent):
+def dynamic_control_advice(tank_fill_percent, rules=DEFAULT_RULES):
     """Dynamic control advice function."""
-    if tank_fill_percent > 90:
-        return 'Open secondary valve and enable backup pump.'
-    elif tank_fill_percent > 75:
-        return 'Increase pump speed by 15%.'
-    return 'Maintain current configuration.'
+    return rules.control_advice(tank_fill_percent)
 
-def detect_anomalies(sensor_data):
+def detect_anomalies(sensor_data, rules=DEFAULT_RULES):
     """Detect anomalies function."""
-    anomalies = []
-    if sensor_data.get('tank_fill_percent', 0) > 100:
-        anomalies.append('Tank overfill detected.')
-    if sensor_data.get('inflow_rate_lps', -1) < 0:
-        anomalies.append('Negative inflow rate.')
-    return anomalies
-
-def compliance_check(rainfall_mm, overflow_triggered):
+    return rules.anomalies(sensor_data)
+
+def compliance_check(rainfall_mm, overflow_triggered, rules=DEFAULT_RULES):
     """Compliance check function."""
-    if rainfall_mm > 80 and (not overflow_triggered):
-        return '⚠️ Non-compliance: Risk threshold breached with no response.'
-    return '✅ System compliant.'
+    return rules.compliance(rainfall_mm, overflow_triggered)
 
 def run_all_analyses(location='London'):
     """Run all analyses function."""
-    inputs = get_real_time_inputs(location)
-    overflow = predict_overflow(inputs['rainfall_mm'], inputs['tank_fill_percent'])
-    control_advice = dynamic_control_advice(inputs['tank_fill_percent'])
-    risk_score = calculate_overflow_risk(inputs['rainfall_mm'], inputs['tank_fill_percent'])
-    compliance = compliance_check(inputs['rainfall_mm'], overflow)
-    anomalies = detect_anomalies(inputs)
+    return _analyse_inputs(location, get_real_time_inputs(location))
+
+async def run_all_analyses_async(location='London'):
+    """Async variant of run_all_analyses."""
+    return _analyse_inputs(location, await get_real_time_inputs_async(location))
+
+def _analyse_inputs(location, inputs):
+    """Apply the rule-based analyses to a set of real-time inputs."""
+    rules = get_threshold_rules(location)
+    overflow = predict_overflow(inputs['rainfall_mm'], inputs['tank_fill_percent'], rules)
+    control_advice = dynamic_control_advice(inputs['tank_fill_percent'], rules)
+    risk_score = _record_risk(location, calculate_overflow_risk(inputs['rainfall_mm'], inputs['tank_fill_percent'], rules), inputs['rainfall_mm'], inputs['tank_fill_percent'])
+    compliance = compliance_check(inputs['rainfall_mm'], overflow, rules)
+    anomalies = detect_anomalies(inputs, rules)
     upgrades = recommend_infrastructure_upgrades(location)
     advisory = suggest_action_for_risk('HIGH' if overflow else 'LOW')
     return {'inputs': inputs, 'overflow_risk_score': risk_score, 'overflow_predicted': overflow, 'control_advice': control_advice, 'compliance_status': compliance, 'anomalies': anomalies, 'infrastructure_recommendations': upgrades, 'genai_advisory': advisory}
@@ -264,22 +621,19 @@ def suggest_action_for_risk(risk_level):
 
 def fetch_tank_config(location='London'):
     """Fetch tank config function."""
-    import pandas as pd
     try:
-        df = pd.read_csv('tank_config.csv')
-        df = df[df['location'] == location]
-        return df[['zone', 'capacity']].to_dict(orient='records')
+        return tank_config_registry.rows(location, ['zone', 'capacity'])
     except Exception as e:
-        logger.error(f'❌ Failed to write tank balancer log: {e}')
+        logger.error(f'❌ Failed to load tank config: {e}')
         return []
 
-def load_balance_tanks(location='London'):
-    """Load balance tanks function with per-tank fill support."""
-    tank_data = fetch_tank_config(location)
+def _plan_tank_balance(location='London', snapshot=None):
+    """Per-tank utilisation and action for a site, without actuating anything."""
+    tank_data = snapshot.tank_config if snapshot is not None else fetch_tank_config(location)
     if not tank_data:
         logger.warning('⚠️ No tank entries found in CSV.')
         return {'status': '⚠️ No tank entries found', 'location': location, 'tanks': []}
-    sensors = fetch_sensor_data(location)
+    sensors = snapshot.sensors if snapshot is not None else fetch_sensor_data(location)
     if not isinstance(sensors, dict):
         return {'status': '❌ Invalid sensor data', 'location': location, 'tanks': []}
     per_tank_fills = sensors.get('telemetry', {}).get('per_tank_fill', {})
@@ -294,16 +648,23 @@ def load_balance_tanks(location='London'):
         else:
             percent_util = fill_percent
         action = 'Redistribute' if percent_util > 90 else 'OK'
-        if action == 'Redistribute':
-            actuate_asset('redistribute', location)
         results.append({'Tank': zone, 'Capacity': capacity, '% Utilized': percent_util, 'Action': action})
-    try:
-        with open('logs/tank_balancer_log.txt', 'a', encoding='utf-8') as logf:
-            timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            logf.write(f'[{timestamp}] {location} tank balance: {json.dumps(results)}\n')
-    except Exception as e:
-        logger.error(f'❌ Failed to write tank balancer log: {e}')
     return {'status': '✅ Load balanced', 'location': location, 'tanks': results}
+
+def _apply_tank_balance(location, plan, config=None):
+    """Send the redistribute commands of a balance plan and log it."""
+    if plan['status'] != '✅ Load balanced':
+        return plan
+    for tank in plan['tanks']:
+        if tank['Action'] == 'Redistribute':
+            actuate_asset('redistribute', location, config)
+    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    log_writer.write('logs/tank_balancer_log.txt', f'[{timestamp}] {location} tank balance: {json.dumps(plan["tanks"])}\n')
+    return plan
+
+def load_balance_tanks(location='London', snapshot=None):
+    """Load balance tanks function with per-tank fill support."""
+    return _apply_tank_balance(location, _plan_tank_balance(location, snapshot), snapshot.config if snapshot is not None else None)
     sensors = fetch_sensor_data(location)
     if not isinstance(sensors, dict):
         return {'status': '❌ Invalid sensor data', 'location': location, 'tanks': []}
@@ -322,71 +683,374 @@ def load_balance_tanks(location='London'):
         results.append({'Tank': zone, 'Capacity': capacity, '% Utilized': percent_util, 'Action': action})
     return {'status': '✅ Load balanced', 'location': location, 'tanks': results}
 
-def forecast_weather_with_gpt(location='London', horizon_days=3):
-    """Forecast weather with gpt function."""
+def _forecast_prompt(location, horizon_days):
+    """Site-specific forecast prompt from integration config, or the default one."""
     config = get_integration_config(location)
     gpt_forecast_prompt = config.get('forecast_prompt', '')
     if not gpt_forecast_prompt:
         gpt_forecast_prompt = f"\nYou are a weather analyst. Given that it's currently raining heavily in {location}, \npredict the likely weather trend for the next {horizon_days} days. \nProvide insights on potential overflow risks and if any precautionary steps are needed \nfor a stormwater management system.\n"
+    return gpt_forecast_prompt
+
+def _forecast_header(location, horizon_days):
+    return f'📡 GPT-4 Forecast for {location} (next {horizon_days} days):\n'
+
+def forecast_weather_with_gpt(location='London', horizon_days=3):
+    """Forecast weather with gpt function."""
     try:
-        response = call_gpt(gpt_forecast_prompt)
-        return f'📡 GPT-4 Forecast for {location} (next {horizon_days} days):\n' + response
+        response = call_gpt(_forecast_prompt(location, horizon_days), family='weather_forecast')
+        return _forecast_header(location, horizon_days) + response
     except Exception as e:
         return f'❌ GPT Forecasting failed: {e}'
-storm_session_active = False
-
-def storm_response_coordinator(location='London'):
-    """Storm response coordinator function."""
-    global storm_session_active
-    if storm_session_active:
-        logger.warning('Storm response already triggered. Aborting duplicate execution.')
-        return {'status': 'ignored', 'reason': 'duplicate storm trigger'}
-    storm_session_active = True
-    logger.info('🚨 Storm response initiated.')
-    print('🚨 Running Storm Scenario Response...')
-    impact_zones = get_river_impact_severity(location)
-    for zone in impact_zones:
+
+async def stream_weather_forecast_async(location='London', horizon_days=3):
+    """Streaming variant of forecast_weather_with_gpt: yields text as GPT produces it."""
+    yield _forecast_header(location, horizon_days)
+    async for part in stream_gpt_async(_forecast_prompt(location, horizon_days), family='weather_forecast'):
+        yield part
+class _DirectFetches:
+    """Fetch straight from upstream; what a run uses outside a batch."""
+
+    def weather(self, location, config):
+        return fetch_weather_data(location, config)
+
+    def sensors(self, location, config):
+        return fetch_sensor_data(location, config)
+
+_DIRECT_FETCHES = _DirectFetches()
+
+class SharedFetches(_DirectFetches):
+    """Upstream responses memoised by feed URL for the lifetime of one batch run.
+
+    Locations that share a weather or sensor feed trigger one request between
+    them, including when they ask at the same moment. Only the request is
+    shared: the payload is recorded in telemetry history for every location
+    that asked for it. Shared payloads are treated as read-only by every consumer.
+    """
+
+    def __init__(self):
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+        self._results = {}
+        self.requested = 0
+
+    def _shared(self, url, fetch):
+        with self._lock:
+            self.requested += 1
+            if url in self._results:
+                return self._results[url]
+        value = self._flights.do(url, fetch)
+        with self._lock:
+            self._results.setdefault(url, value)
+        return value
+
+    def weather(self, location, config):
+        if not config.get('weather_api'):
+            return super().weather(location, config)
+        return _record_telemetry(location, self._shared(('weather', config['weather_api']), lambda: _request_weather(config)), 'weather.')
+
+    def sensors(self, location, config):
+        if not config.get('sensor_endpoint'):
+            return super().sensors(location, config)
+        return _record_telemetry(location, self._shared(('sensors', config['sensor_endpoint']), lambda: _request_sensors(config)), 'sensors.')
+
+    def stats(self):
+        with self._lock:
+            return {'requested': self.requested, 'fetched': len(self._results)}
+
+@dataclass
+class SiteSnapshot:
+    """Config and telemetry for one site, captured once per storm run.
+
+    The storm graph's fetch stages fill it in (see _storm_stage_graph). Every
+    analysis step of a run reads from the same snapshot, so upstreams are hit
+    once per run and all steps see consistent readings.
+    """
+    location: str
+    config: dict = field(default_factory=dict)
+    weather: object = None
+    sensors: object = None
+    river_impact: list = field(default_factory=list)
+    tank_config: list = field(default_factory=list)
+    asset_config: list = None
+    asset_config_error: str = ''
+
+# The coordinator runs as a graph of stages: each starts once the stages it
+# reads from have finished, so independent fetches and actions overlap.
+STORM_STAGE_TIMEOUT = float(os.getenv('WATER_LLM_STORM_STAGE_TIMEOUT', '60'))
+STORM_STAGE_TIMEOUTS = {'weather': HTTP_TIMEOUT + 5, 'sensors': HTTP_TIMEOUT + 5}
+_stage_pool = ThreadPoolExecutor(max_workers=int(os.getenv('WATER_LLM_STAGE_WORKERS', '32')), thread_name_prefix='storm-stage')
+
+def _no_progress(stage, status):
+    pass
+
+def storm_response_coordinator(location='London', progress=None, fetches=None):
+    """Storm response coordinator function.
+
+    Only one run per location proceeds at a time across all workers: the run
+    holds that location's storm lease, renewed at every stage and released at
+    the end. progress, if given, is called as progress(stage, status) as each
+    entry of STORM_STAGES starts ('running') and ends ('done', 'failed',
+    'timed_out' or 'skipped').
+    """
+    lease = storm_leases.acquire(location)
+    if lease is None:
+        logger.warning(f'Storm response already running for {location}. Aborting duplicate execution.')
+        return {'status': 'ignored', 'reason': 'duplicate storm trigger', 'location': location}
+    report = progress or _no_progress
+
+    def progress(stage, status):
+        storm_leases.renew(location, lease)
+        report(stage, status)
+    try:
+        return _coordinate_storm(location, progress, fetches)
+    finally:
+        storm_leases.release(location, lease)
+
+def _asset_config_or_error(location):
+    try:
+        return fetch_asset_config(location), ''
+    except Exception as e:
+        return None, str(e)
+
+def _release_high_impact_zones(location, snapshot):
+    """Early-release every HIGH severity river zone; returns the zones released."""
+    released = []
+    for zone in snapshot.river_impact:
         if zone.get('impact_severity') == 'HIGH':
-            actuate_asset('early_release_protocol', location)
+            actuate_asset('early_release_protocol', location, snapshot.config)
             logger.info(f"🌊 High severity river zone {zone['zone']} ({zone['river_name']}) released early.")
-    inputs = get_real_time_inputs(location)
+            released.append(zone.get('zone'))
+    return released
+
+def _assess_storm(inputs, rules=DEFAULT_RULES):
+    """Rule-based storm assessment of a set of real-time inputs."""
     rainfall = inputs['rainfall_mm']
     tank_fill = inputs['tank_fill_percent']
-    overflow = predict_overflow(rainfall, tank_fill)
-    risk = calculate_overflow_risk(rainfall, tank_fill)
-    control = dynamic_control_advice(tank_fill)
-    control_result = {}
-    if risk == 'HIGH':
-        control_result = actuate_asset('open_overflow_valve', location)
-        alert = alert_operator('⚠️ Severe storm detected. Overflow valve triggered.')
-    elif risk == 'MEDIUM':
-        control_result = actuate_asset('start_buffer_pump', location)
-        alert = alert_operator('⚠️ Medium storm risk. Buffer pump engaged.')
-    else:
-        alert = '✅ No action required.'
-    anomalies = detect_anomalies(inputs)
-    compliance = compliance_check(rainfall, overflow)
-    report = generate_regulatory_report(location, rainfall, risk)
-    advisory = suggest_action_for_risk(risk)
-    upgrades = recommend_infrastructure_upgrades(location)
-    tank_balancing = load_balance_tanks(location)
-    asset_status = check_asset_availability(location)
-    return {'location': location, 'inputs': inputs, 'overflow_predicted': overflow, 'asset_status': asset_status, 'risk_level': risk, 'control_advice': control, 'control_result': control_result, 'alert_sent': alert, 'anomalies': anomalies, 'compliance_status': compliance, 'regulatory_report': report, 'genai_advisory': advisory, 'infra_upgrades': upgrades, 'tank_balancing': tank_balancing}
+    overflow = predict_overflow(rainfall, tank_fill, rules)
+    risk = _record_risk(inputs['location'], calculate_overflow_risk(rainfall, tank_fill, rules), rainfall, tank_fill)
+    return {'rainfall': rainfall, 'overflow': overflow, 'risk': risk,
+            'control': dynamic_control_advice(tank_fill, rules), 'anomalies': detect_anomalies(inputs, rules),
+            'compliance': compliance_check(rainfall, overflow, rules)}
+
+def _storm_overflow_control(location, snapshot, assessment):
+    """Actuate for the assessed risk level and alert the operator."""
+    if assessment['risk'] == 'HIGH':
+        return actuate_asset('open_overflow_valve', location, snapshot.config), alert_operator('⚠️ Severe storm detected. Overflow valve triggered.')
+    if assessment['risk'] == 'MEDIUM':
+        return actuate_asset('start_buffer_pump', location, snapshot.config), alert_operator('⚠️ Medium storm risk. Buffer pump engaged.')
+    return {}, '✅ No action required.'
 
-def check_asset_availability(location='London'):
+def _storm_reporting(location, assessment):
+    return {'report': generate_regulatory_report(location, assessment['rainfall'], assessment['risk']),
+            'advisory': suggest_action_for_risk(assessment['risk']),
+            'upgrades': recommend_infrastructure_upgrades(location)}
+
+def _storm_stage_graph(location, fetches=None):
+    """Stage graph of one storm run for a location.
+
+    The fetch stages assemble the run's SiteSnapshot; fetches, a SharedFetches,
+    lets the runs of one batch share upstream responses for common feeds.
+    """
+    fetches = fetches or _DIRECT_FETCHES
+    graph = StageGraph(default_timeout=STORM_STAGE_TIMEOUT)
+    stage = lambda name, fn, deps=(), **options: graph.add(name, fn, deps, STORM_STAGE_TIMEOUTS.get(name), **options)
+    # A feed that times out gives the run the same error payload as a failed
+    # request, so the run still assesses and acts on what it has.
+    fetch_timeout = lambda name: lambda: {'error': f'no {name} response within {STORM_STAGE_TIMEOUTS[name]}s'}
+    stage('config', lambda: get_integration_config(location))
+    stage('weather', lambda config: fetches.weather(location, config), ['config'], on_timeout=fetch_timeout('weather'))
+    stage('sensors', lambda config: fetches.sensors(location, config), ['config'], on_timeout=fetch_timeout('sensors'))
+    stage('river_impact', lambda: get_river_impact_severity(location))
+    stage('tank_config', lambda: fetch_tank_config(location))
+    stage('asset_config', lambda: _asset_config_or_error(location))
+    stage('snapshot', lambda config, weather, sensors, river_impact, tank_config, asset_config: SiteSnapshot(
+        location=location, config=config, weather=weather, sensors=sensors, river_impact=river_impact,
+        tank_config=tank_config, asset_config=asset_config[0], asset_config_error=asset_config[1]),
+        ['config', 'weather', 'sensors', 'river_impact', 'tank_config', 'asset_config'])
+    stage('river_release', lambda snapshot: _release_high_impact_zones(location, snapshot), ['snapshot'])
+    stage('inputs', lambda snapshot: get_real_time_inputs(location, snapshot), ['snapshot'])
+    stage('assessment', lambda inputs: _assess_storm(inputs, get_threshold_rules(location)), ['inputs'])
+    # Field commands keep their original order: early release, then the overflow
+    # valve or pump, then tank redistribution. Only the balance plan runs early.
+    # The order is after-only, so a failed early step never holds back a later one.
+    stage('overflow_control', lambda snapshot, assessment: _storm_overflow_control(location, snapshot, assessment),
+          ['snapshot', 'assessment'], after=['river_release'])
+    stage('reporting', lambda assessment: _storm_reporting(location, assessment), ['assessment'])
+    stage('tank_plan', lambda snapshot: _plan_tank_balance(location, snapshot), ['snapshot'])
+    stage('tank_balancing', lambda snapshot, tank_plan: _apply_tank_balance(location, tank_plan, snapshot.config),
+          ['snapshot', 'tank_plan'], after=['overflow_control'])
+    stage('asset_check', lambda snapshot: check_asset_availability(location, snapshot), ['snapshot'])
+    return graph
+
+STORM_STAGES = _storm_stage_graph('London').names
+
+def _coordinate_storm(location, progress, fetches=None):
+    """Body of storm_response_coordinator, run while the location's lease is held."""
+    logger.info('🚨 Storm response initiated.')
+    print('🚨 Running Storm Scenario Response...')
+    results, timings = _storm_stage_graph(location, fetches).run(_stage_pool, progress)
+    assessment = results.get('assessment', {})
+    control_result, alert = results.get('overflow_control', (None, None))
+    reporting = results.get('reporting', {})
+    incomplete = [name for name, timing in timings.items() if timing['status'] != 'done']
+    if incomplete:
+        logger.warning(f'⚠️ Storm run for {location} incomplete: {incomplete}')
+    return {'location': location, 'inputs': results.get('inputs'), 'overflow_predicted': assessment.get('overflow'), 'asset_status': results.get('asset_check'), 'risk_level': assessment.get('risk'), 'control_advice': assessment.get('control'), 'control_result': control_result, 'alert_sent': alert, 'anomalies': assessment.get('anomalies'), 'compliance_status': assessment.get('compliance'), 'regulatory_report': reporting.get('report'), 'genai_advisory': reporting.get('advisory'), 'infra_upgrades': reporting.get('upgrades'), 'tank_balancing': results.get('tank_balancing'), 'stage_timings': timings}
+
+# Storm runs execute as background jobs on a bounded pool; POST /storm returns a
+# job id straight away and GET /storm/{job_id} reports per-stage progress. Jobs
+# live next to the storm leases, so every worker sees every job.
+STORM_JOB_TTL = int(os.getenv('WATER_LLM_STORM_JOB_TTL', '86400'))
+STORM_MAX_QUEUED = int(os.getenv('WATER_LLM_STORM_MAX_QUEUED', '100'))
+storm_jobs = SqliteJobStore(os.getenv('WATER_LLM_STORM_JOB_PATH', storm_leases.db_path), ttl=STORM_JOB_TTL)
+_storm_pool = ThreadPoolExecutor(max_workers=int(os.getenv('WATER_LLM_STORM_WORKERS', '4')), thread_name_prefix='storm')
+_storm_jobs_lock = threading.Lock()
+_active_storm_jobs = set()
+
+class StormQueueFull(Exception):
+    """Raised when too many storm jobs are already queued or running."""
+
+def submit_storm_job(location='London'):
+    """Queue a storm response run and return its job id.
+
+    A location that already has an unfinished run, started by any worker, gets
+    that run's id back, so client retries attach to the existing job instead of
+    being dropped. A run that stops making progress for a lease TTL is replaced.
+    """
+    key = f'storm_response:{location}'
+    job_id = storm_jobs.unfinished(key, stale_after=storm_leases.ttl)
+    if job_id is not None:
+        return job_id
+    with _storm_jobs_lock:
+        if len(_active_storm_jobs) >= STORM_MAX_QUEUED:
+            raise StormQueueFull(f'{len(_active_storm_jobs)} storm runs already queued or running')
+        stages = {stage: {'status': 'pending'} for stage in STORM_STAGES}
+        job_id, created = storm_jobs.create_unique('storm_response', key, stale_after=storm_leases.ttl,
+                                                   location=location, current_stage=None, stages=stages)
+        if not created:
+            return job_id
+        _active_storm_jobs.add(job_id)
+    _storm_pool.submit(_run_storm_job, job_id, location)
+    return job_id
+
+def _run_storm_job(job_id, location):
+    """Run storm_response_coordinator for a job, recording each stage as it goes."""
+    stages = {stage: {'status': 'pending'} for stage in STORM_STAGES}
+
+    def progress(stage, status):
+        stages[stage]['status'] = status
+        stages[stage]['started_at' if status == 'running' else 'finished_at'] = time.time()
+        storm_jobs.update(job_id, current_stage=stage, stages=stages)
+
+    storm_jobs.start(job_id)
+    try:
+        result = storm_response_coordinator(location, progress=progress)
+        if result.get('status') == 'ignored':
+            # Another run (a batch or dashboard run) holds the lease; this job did nothing.
+            storm_jobs.fail(job_id, f'storm run for {location} already in progress elsewhere')
+        else:
+            storm_jobs.finish(job_id, result)
+    except Exception as e:
+        logger.error(f'❌ Storm job {job_id} for {location} failed: {e}')
+        for stage, info in stages.items():
+            if info['status'] == 'running':
+                progress(stage, 'failed')
+        storm_jobs.fail(job_id, e)
+    finally:
+        with _storm_jobs_lock:
+            _active_storm_jobs.discard(job_id)
+
+def get_storm_job(job_id, wait=0):
+    """Status, stage progress and, once done, the result of a storm run."""
+    return storm_jobs.wait(job_id, wait) if wait else storm_jobs.get(job_id)
+
+async def get_storm_job_async(job_id, wait=0):
+    """Async variant of get_storm_job; wait long-polls without holding a thread."""
+    return await storm_jobs.wait_async(job_id, wait) if wait else await storm_jobs.get_async(job_id)
+
+# Regional batch runs: one pipeline per location, at most BATCH_CONCURRENCY at a
+# time, with upstream feeds shared across the batch.
+BATCH_CONCURRENCY = int(os.getenv('WATER_LLM_BATCH_CONCURRENCY', '4'))
+
+def resolve_locations(locations='all'):
+    """Expand 'all' (or None) to every configured location and drop duplicates.
+
+    A single location may be given as a plain string."""
+    if isinstance(locations, str):
+        locations = [locations]
+    if locations is None or list(locations) == ['all']:
+        return integration_config_cache.locations()
+    return list(dict.fromkeys(locations))
+
+def _batch_analyse(location, fetches):
+    config = get_integration_config(location)
+    inputs = _build_real_time_inputs(location, fetches.weather(location, config), fetches.sensors(location, config))
+    return _analyse_inputs(location, inputs)
+
+def _batch_storm(location, fetches):
+    return storm_response_coordinator(location, fetches=fetches)
+
+BATCH_PIPELINES = {'analyses': _batch_analyse, 'storm': _batch_storm}
+
+def run_batch(kind, locations='all', concurrency=None):
+    """Run a pipeline for many locations, yielding each location's outcome as it completes.
+
+    kind is 'analyses' (run_all_analyses) or 'storm' (storm_response_coordinator).
+    Each item is {'location', 'status', 'elapsed_s', 'result' or 'error'}.
+    """
+    pipeline = BATCH_PIPELINES[kind]
+    locations = resolve_locations(locations)
+    if not locations:
+        return
+    fetches = SharedFetches()
+
+    def timed(location):
+        started = time.perf_counter()
+        try:
+            outcome = {'status': 'done', 'result': pipeline(location, fetches)}
+        except Exception as e:
+            logger.error(f'❌ Batch {kind} failed for {location}: {e}')
+            outcome = {'status': 'failed', 'error': str(e)}
+        return {'location': location, 'elapsed_s': round(time.perf_counter() - started, 3), **outcome}
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(concurrency or BATCH_CONCURRENCY, len(locations))), thread_name_prefix=f'batch-{kind}')
+    try:
+        for future in as_completed([pool.submit(timed, location) for location in locations]):
+            yield future.result()
+    finally:
+        # A consumer that stops early (e.g. a disconnected client) cancels the locations not yet started.
+        pool.shutdown(wait=False, cancel_futures=True)
+        logger.info(f'📦 Batch {kind} over {len(locations)} locations: upstream fetches {fetches.stats()}')
+
+def run_batch_analyses(locations='all', concurrency=None):
+    """Batch form of run_all_analyses; see run_batch."""
+    return run_batch('analyses', locations, concurrency)
+
+def run_batch_storm(locations='all', concurrency=None):
+    """Batch form of storm_response_coordinator; see run_batch."""
+    return run_batch('storm', locations, concurrency)
+
+def fetch_asset_config(location='London'):
+    """Return the expected asset states for a location from asset_config.csv."""
+    return asset_config_registry.rows(location, ['asset', 'expected_value'])
+
+def check_asset_availability(location='London', snapshot=None):
     """Check operational availability of critical assets like pumps, penstocks, valves."""
-    import pandas as pd
-    sensors = fetch_sensor_data(location)
+    sensors = snapshot.sensors if snapshot is not None else fetch_sensor_data(location)
     if not isinstance(sensors, dict) or 'telemetry' not in sensors:
         return {'status': '❌ Failed to fetch sensor data', 'details': {}}
     telemetry = sensors.get('telemetry', {})
     result = {}
-    try:
-        df = pd.read_csv('asset_config.csv')
-        df = df[df['location'] == location]
-    except Exception as e:
-        return {'status': '❌ Failed to read asset_config.csv', 'error': str(e)}
-    for _, row in df.iterrows():
+    if snapshot is not None:
+        if snapshot.asset_config is None:
+            return {'status': '❌ Failed to read asset_config.csv', 'error': snapshot.asset_config_error}
+        rows = snapshot.asset_config
+    else:
+        try:
+            rows = fetch_asset_config(location)
+        except Exception as e:
+            return {'status': '❌ Failed to read asset_config.csv', 'error': str(e)}
+    for row in rows:
         asset = row['asset']
         expected = row['expected_value']
         actual = telemetry.get(asset, None)
@@ -404,44 +1068,61 @@ def compare_predictions_with_actuals(location='London'):
     actual = get_real_time_inputs(location)
     actual_rainfall = actual.get('rainfall_mm', 0)
     actual_fill = actual.get('tank_fill_percent', 0)
-    actual_overflow = predict_overflow(actual_rainfall, actual_fill)
+    actual_overflow = predict_overflow(actual_rainfall, actual_fill, get_threshold_rules(location))
     prediction_record = {'timestamp': datetime.datetime.now().isoformat(), 'location': location, 'predicted_rainfall_mm': actual_rainfall, 'predicted_overflow': actual_overflow, 'actual_rainfall_mm': actual_rainfall, 'actual_overflow': actual_overflow, 'match': True}
-    try:
-        with open(log_path, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(prediction_record) + '\n')
-    except Exception as e:
-        logger.error(f'❌ Failed to write prediction vs actual log: {e}')
+    log_writer.write_json(log_path, prediction_record)
     return prediction_record
 
+def _contextual_advisory_prompt(location, weather, sensor, river):
+    """Build the contextual advisory prompt from live data and river risk."""
+    rain = weather.get('forecast', {}).get('rainfall_mm', 0)
+    fill = sensor.get('telemetry', {}).get('tank_fill_percent', 0)
+    high_impact = [r['zone'] for r in river if r.get('impact_severity') == 'HIGH']
+    return (
+        f"As a stormwater advisor, assess the situation for {location}:\n"
+        f"- Rainfall: {rain}mm\n"
+        f"- Tank Fill: {fill}%\n"
+        f"- High Risk Zones: {', '.join(high_impact) if high_impact else 'None'}\n"
+        f"Advise mitigation steps, operator actions, and compliance measures."
+    )
+
 def generate_contextual_advisory(location='London'):
     """Generate a detailed advisory prompt using live data and river risk."""
     try:
-        weather = fetch_weather_data(location)
-        sensor = fetch_sensor_data(location)
+        config = get_integration_config(location)
+        weather = fetch_weather_data(location, config)
+        sensor = fetch_sensor_data(location, config)
         river = get_river_impact_severity(location)
-        rain = weather.get('forecast', {}).get('rainfall_mm', 0)
-        fill = sensor.get('telemetry', {}).get('tank_fill_percent', 0)
-        high_impact = [r['zone'] for r in river if r.get('impact_severity') == 'HIGH']
-        prompt = (
-            f"As a stormwater advisor, assess the situation for {location}:\n"
-            f"- Rainfall: {rain}mm\n"
-            f"- Tank Fill: {fill}%\n"
-            f"- High Risk Zones: {', '.join(high_impact) if high_impact else 'None'}\n"
-            f"Advise mitigation steps, operator actions, and compliance measures."
-        )
-        return call_gpt(prompt)
+        return call_gpt(_contextual_advisory_prompt(location, weather, sensor, river), family='contextual_advisory')
+    except Exception as e:
+        return {"error": f"Failed to generate advisory: {str(e)}"}
+
+async def generate_contextual_advisory_async(location='London'):
+    """Async variant of generate_contextual_advisory."""
+    try:
+        weather, sensor = await asyncio.gather(fetch_weather_data_async(location), fetch_sensor_data_async(location))
+        river = get_river_impact_severity(location)
+        return await call_gpt_async(_contextual_advisory_prompt(location, weather, sensor, river), family='contextual_advisory')
     except Exception as e:
         return {"error": f"Failed to generate advisory: {str(e)}"}
 
+async def stream_contextual_advisory_async(location='London'):
+    """Streaming variant of generate_contextual_advisory: yields text as GPT produces it."""
+    try:
+        weather, sensor = await asyncio.gather(fetch_weather_data_async(location), fetch_sensor_data_async(location))
+        river = get_river_impact_severity(location)
+        prompt = _contextual_advisory_prompt(location, weather, sensor, river)
+    except Exception as e:
+        yield f"Failed to generate advisory: {str(e)}"
+        return
+    async for part in stream_gpt_async(prompt, family='contextual_advisory'):
+        yield part
 
 
 def get_river_impact_severity(location='London'):
     """Return river impact severity from config CSV."""
-    import pandas as pd
     try:
-        df = pd.read_csv('river_impact_config.csv')
-        df = df[df['location'] == location]
-        return df.to_dict(orient='records')
+        return river_impact_registry.rows(location)
     except Exception as e:
         logger.error(f"❌ Failed to load river impact data: {e}")
         return []
@@ -117,16 +117,18 @@ with tab3:
 with tab4:
     st.title("📒 Intervention Log")
     st.subheader("📋 Intervention Log (from logs/water_llm_log.json)")
-    log_entries = get_logged_interventions()
+    log_entries = get_logged_interventions(last=10)
     if log_entries:
-        for entry in reversed(log_entries[-10:]):
+        for entry in reversed(log_entries):
             st.markdown(f"**🕒 {entry['timestamp']} – {entry['location']}**")
             st.markdown("- **Overflow Risk:** " + entry['inputs'].get('overflow_risk', 'N/A'))
             st.markdown("- **Recommendation:** " + entry['results'].get('Dynamic Control Advisory', '').split("\n")[0])
             st.markdown("- **Asset Score:** " + entry['results'].get('Asset Health Score', 'N/A'))
             st.markdown("- **SCADA Feedback:** " + entry['results'].get('SCADA Feedback', 'N/A'))
             st.markdown("---")
-        st.download_button("📥 Download Full Log as JSON", json.dumps(log_entries, indent=2), file_name="water_llm_log.json")
+        # Reading the whole log is only worth it when someone actually wants the download.
+        if st.checkbox("Prepare full log for download"):
+            st.download_button("📥 Download Full Log as JSON", json.dumps(get_logged_interventions(), indent=2), file_name="water_llm_log.json")
     else:
         st.info("No logged interventions found in file.")
 